@@ -0,0 +1,188 @@
+import asyncio
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+
+
+THROTTLE_MARKERS = ('54003', 'qps', 'too many requests', 'rate limit')
+
+OVERLOADED_MESSAGE = '服务繁忙，请稍后重试(Service is busy, please retry later)'
+
+
+class UpstreamThrottled(RuntimeError):
+    pass
+
+
+class Overloaded(RuntimeError):
+    pass
+
+
+def is_throttle_error(e):
+    if isinstance(e, UpstreamThrottled):
+        return True
+    text = str(e).lower()
+    return any(marker in text for marker in THROTTLE_MARKERS)
+
+
+def _resolve(future):
+    if not future.done():
+        future.set_result(None)
+
+
+class _Ticket(object):
+
+    def __init__(self, key, loop):
+        self.key = key
+        self.loop = loop
+        self.granted = False
+        self.started = None
+        self.waiter = threading.Event() if loop is None else loop.create_future()
+
+    def wake(self, now):
+        self.granted = True
+        self.started = now
+        if self.loop is None:
+            self.waiter.set()
+        else:
+            self.loop.call_soon_threadsafe(_resolve, self.waiter)
+
+
+class AdaptiveLimiter(object):
+    """
+    Admission control for one upstream API.
+
+    At most `limit` calls are in flight. The limit grows by `increase` for every `limit`
+    successful calls (about once per round trip) and is multiplied by `decrease` when
+    the upstream throttles us or average latency exceeds `latency_target`, no more
+    than once per `cooldown` seconds. Callers beyond the limit wait in FIFO order and can see their position;
+    once `max_queue` are waiting, or after `max_wait` seconds, they get Overloaded.
+
+    Callers on threads use `acquire()`/`slot()`, callers on an event loop use
+    `acquire_async()`; both release with `release(ticket, outcome)`.
+    """
+
+    def __init__(self, name, initial_limit=16, min_limit=1, max_limit=128, increase=1.0, decrease=0.5,
+                 latency_target=None, cooldown=1.0, max_queue=512, max_wait=120.0, clock=time.monotonic):
+        self.name = name
+        self.limit = float(initial_limit)
+        self.min_limit = min_limit
+        self.max_limit = max_limit
+        self.increase = increase
+        self.decrease = decrease
+        self.latency_target = latency_target
+        self.cooldown = cooldown
+        self.max_queue = max_queue
+        self.max_wait = max_wait
+        self.clock = clock
+        self.in_flight = 0
+        self.latency = None
+        self.successes = 0
+        self.errors = 0
+        self.throttles = 0
+        self.shed = 0
+        self._lock = threading.Lock()
+        self._queue = deque()
+        self._last_decrease = float('-inf')
+
+    def stats(self):
+        with self._lock:
+            return {
+                'name': self.name,
+                'limit': self.limit,
+                'in_flight': self.in_flight,
+                'queued': len(self._queue),
+                'latency_ewma': self.latency,
+                'successes': self.successes,
+                'errors': self.errors,
+                'throttles': self.throttles,
+                'shed': self.shed,
+            }
+
+    def position(self, key):
+        """1-based queue position of the first waiter with `key`, or None if it is not queued."""
+        with self._lock:
+            for i, ticket in enumerate(self._queue):
+                if ticket.key == key:
+                    return i + 1
+        return None
+
+    def _enter(self, key, loop):
+        with self._lock:
+            ticket = _Ticket(key, loop)
+            if not self._queue and self.in_flight < int(self.limit):
+                self.in_flight += 1
+                ticket.wake(self.clock())
+            elif len(self._queue) >= self.max_queue:
+                self.shed += 1
+                raise Overloaded(OVERLOADED_MESSAGE)
+            else:
+                self._queue.append(ticket)
+            return ticket
+
+    def _abandon(self, ticket, shed=True):
+        with self._lock:
+            if ticket.granted:
+                return False
+            self._queue.remove(ticket)
+            if shed:
+                self.shed += 1
+            return True
+
+    def acquire(self, key=None, timeout=None):
+        ticket = self._enter(key, None)
+        if not ticket.waiter.wait(self.max_wait if timeout is None else timeout) and self._abandon(ticket):
+            raise Overloaded(OVERLOADED_MESSAGE)
+        return ticket
+
+    async def acquire_async(self, key=None, timeout=None):
+        ticket = self._enter(key, asyncio.get_running_loop())
+        try:
+            await asyncio.wait_for(asyncio.shield(ticket.waiter), self.max_wait if timeout is None else timeout)
+        except asyncio.TimeoutError:
+            if self._abandon(ticket):
+                raise Overloaded(OVERLOADED_MESSAGE)
+        except BaseException:
+            if not self._abandon(ticket, shed=False):
+                self.release(ticket, 'cancelled')
+            raise
+        return ticket
+
+    def release(self, ticket, outcome='ok'):
+        """`outcome` is 'ok', 'error', 'throttled' or 'cancelled'."""
+        latency = self.clock() - ticket.started
+        with self._lock:
+            self.in_flight -= 1
+            if outcome == 'ok':
+                self.successes += 1
+                self.latency = latency if self.latency is None else 0.8 * self.latency + 0.2 * latency
+                if self.latency_target is not None and self.latency > self.latency_target:
+                    self._decrease()
+                else:
+                    self.limit = min(self.max_limit, self.limit + self.increase / max(self.limit, 1.0))
+            elif outcome == 'throttled':
+                self.throttles += 1
+                self._decrease()
+            elif outcome == 'error':
+                self.errors += 1
+            while self._queue and self.in_flight < int(self.limit):
+                self.in_flight += 1
+                self._queue.popleft().wake(self.clock())
+
+    def _decrease(self):
+        now = self.clock()
+        if now - self._last_decrease >= self.cooldown:
+            self.limit = max(self.min_limit, self.limit * self.decrease)
+            self._last_decrease = now
+
+    @contextmanager
+    def slot(self, key=None):
+        ticket = self.acquire(key)
+        outcome = 'ok'
+        try:
+            yield ticket
+        except Exception as e:
+            outcome = 'throttled' if is_throttle_error(e) else 'error'
+            raise
+        finally:
+            self.release(ticket, outcome)
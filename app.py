@@ -1,51 +1,179 @@
+import asyncio
+import os
+import threading
+import time
+
 import numpy as np
 import gradio as gr
-import paddlehub as hub
+from fastapi.responses import JSONResponse, PlainTextResponse
+
+import pipeline
+from metrics import SamplingProfiler, new_trace_id
+from session_queue import SessionQueue
 
+# Load the PaddleHub modules concurrently while the UI is built and starts serving.
+pipeline.modules.warm()
 
-model = hub.Module(name='ernie_vilg')
-language_translation_model = hub.Module(name='baidu_translate')
-language_recognition_model = hub.Module(name='baidu_language_recognition')
+# Images generated per prompt, each shown as soon as it has been downloaded.
+topk = 4
 
-style_list = ['古风', '油画', '水彩', '卡通', '二次元', '浮世绘', '蒸汽波艺术', 'low poly', '像素风格', '概念艺术', '未来主义', '赛博朋克', '写实风格', '洛丽塔风格', '巴洛克风格', '超现实主义', '探索无限']
+# Serve /debug/profile?seconds=N, which samples all threads' stacks for N seconds.
+enable_profiler = os.environ.get('ERNIEVILG_PROFILER') == '1'
 
 tips = {"en": "Tips: The input text will be translated into Chinese for generation", 
         "jp": "ヒント: 入力テキストは生成のために中国語に翻訳されます", 
         "kor": "힌트: 입력 텍스트는 생성을 위해 중국어로 번역됩니다"}
 
-count = 0
 
-def translate_language(text_prompts):
-    global count
+def readiness():
+    if pipeline.modules.ready():
+        return ''
+    return '模型加载中(Loading models)...'
+
+
+def health():
+    status = pipeline.modules.status()
+    return JSONResponse(status, status_code=200 if status['ready'] else 503)
+
+
+def metrics():
+    return PlainTextResponse(pipeline.metrics.render(), media_type='text/plain; version=0.0.4')
+
+
+def trace(trace_id):
+    return JSONResponse(pipeline.metrics.trace(trace_id))
+
+
+async def profile(seconds: float = 10.0):
+    profiler = SamplingProfiler().start()
+    await asyncio.sleep(min(seconds, 60.0))
+    return PlainTextResponse(profiler.stop().collapsed())
+
+
+def generate(text_prompts, style_indx, fresh=False, session=None):
+    # Every stage of one request is recorded under one trace ID, which failed requests show.
+    trace_id = new_trace_id()
+    style = pipeline.style_list[style_indx]
+    session = {} if session is None else session
+    wake = supersede(session, trace_id)
+    try:
+        with pipeline.metrics.timed('request', style, trace_id):
+            yield from _generate(text_prompts, style_indx, fresh, trace_id, style, session, wake)
+    finally:
+        session['wakes'].pop(trace_id, None)
+
+
+def supersede(session, trace_id):
+    """
+    Make `trace_id` the current job of a browser session (its gr.State dict) and wake
+    the session's earlier jobs, which stop once they see they are no longer current.
+    """
+    wake = threading.Event()
+    wakes = session.setdefault('wakes', {})
+    session['current'] = trace_id
+    for other in list(wakes.values()):
+        other.set()
+    wakes[trace_id] = wake
+    return wake
+
+
+def end_session(session):
+    """Stop every running job of a session."""
+    session['current'] = None
+    for wake in list(session.get('wakes', {}).values()):
+        wake.set()
+
+
+def _generate(text_prompts, style_indx, fresh, trace_id, style, session, wake):
+    # Recognition, translation and generation run as stages of one queued job,
+    # streaming the language tip and status before the gallery is ready.
+    if not pipeline.modules.ready():
+        yield {status_text:readiness()}
     try:
-        count += 1
-        tips_text = None
-        language_code = language_recognition_model.recognize(text_prompts)
-        if language_code != 'zh':
-            text_prompts = language_translation_model.translate(text_prompts, language_code, 'zh')
+        text_prompts, language_code = pipeline.translate_language(text_prompts, trace_id)
     except Exception as e:
-        error_text = str(e)
-        return {status_text:error_text, language_tips_text:gr.update(visible=False)}
-    if language_code in tips:
-        tips_text = tips[language_code]
-    else:
-        tips_text = tips['en']
+        pipeline.metrics.error('request', e, style)
+        error_text = '%s [%s]' % (e, trace_id)
+        yield {status_text:error_text, language_tips_text:gr.update(visible=False), gallery:None}
+        return
+    if session.get('current') != trace_id:
+        # Superseded while translating; finish without touching what the newer job shows.
+        yield {status_text:gr.update()}
+        return
     if language_code == 'zh':
-        return {language_tips_text:gr.update(visible=False), translated_language:text_prompts, trigger_component: gr.update(value=count, visible=False)}
+        yield {language_tips_text:gr.update(visible=False), status_text:'生成中(Generating)...'}
     else:
-        return {language_tips_text:gr.update(visible=True, value=tips_text), translated_language:text_prompts, trigger_component:  gr.update(value=count, visible=False)}
+        tips_text = tips.get(language_code, tips['en'])
+        yield {language_tips_text:gr.update(visible=True, value=tips_text), status_text:'生成中(Generating)...'}
+    # Wake on every streamed image, on completion, and when a newer job of this session
+    # or a disconnect supersedes this one, which then cancels the future; the upstream
+    # task stops polling and downloading once no request is waiting on it.
+    future = pipeline.submit_inference(text_prompts, style_indx, fresh, topk, trace_id)
+    progress = future.progress
+    future.add_done_callback(lambda future: wake.set())
+    if progress is not None:
+        progress.listen(wake)
+    start = time.time()
+    shown = 0
+    try:
+        while not future.done():
+            woke = wake.wait(1.0)
+            wake.clear()
+            if session.get('current') != trace_id:
+                yield {status_text:gr.update()}
+                return
+            if future.done():
+                break
+            arrived = progress.paths()
+            if len(arrived) > shown:
+                shown = len(arrived)
+                yield {status_text:'已生成%d/%d张(%d of %d images ready)' % (shown, topk, shown, topk),
+                       gallery:arrived}
+            elif not woke:
+                position = pipeline.queue_position(future)
+                if position is not None:
+                    yield {status_text:'排队中，前面还有%d个请求(Queued, %d ahead of you)' % (position - 1, position - 1)}
+                elif not shown:
+                    yield {status_text:'生成中(Generating)... %ds' % (time.time() - start)}
+        images = future.result()
+    except Exception as e:
+        pipeline.metrics.error('request', e, style)
+        error_text = '%s [%s]' % (e, trace_id)
+        yield {status_text:error_text, gallery:None}
+        return
+    finally:
+        if progress is not None:
+            progress.unlisten(wake)
+        future.cancel()
+    if shown and shown == len(images):
+        # Every image is already in the gallery; re-sending them would only re-download.
+        yield {status_text:'Success'}
+        return
+    # The gallery gets file paths, so Gradio serves the compressed bytes as they are.
+    yield {status_text:'Success', gallery:pipeline.publish(future.key, images)}
 
-        
-def inference(text_prompts, style_indx):
-  try:
-    model.token = model._apply_token(model.ak, model.sk)
-    style = style_list[style_indx]
-    results = model.generate_image(
-        text_prompts=text_prompts, style=style, visualization=False, topk=4)
-  except Exception as e:
-    error_text = str(e)
-    return {status_text:error_text, gallery:None}
-  return {status_text:'Success', gallery:results[:4]}
+
+class FileGallery(gr.Gallery):
+    """
+    A Gallery that serves files under the working directory where they are, instead of
+    copying each one to a new temporary file on every update: images already shown keep
+    their URL, so the browser does not download them again as more stream in.
+    """
+    # Rendered by the frontend's gallery component.
+    is_template = True
+
+    def postprocess(self, y):
+        root = os.path.abspath(os.getcwd())
+        if y and all(isinstance(item, str) and os.path.abspath(item).startswith(root + os.sep) for item in y):
+            return [{"name": os.path.abspath(item), "data": None, "is_file": True} for item in y]
+        return super(FileGallery, self).postprocess(y)
+
+
+def stop_session(session_hash):
+    """Stop the running job of a browser session that resubmitted or went away."""
+    state = block.server_app.state_holder.get(session_hash, {}).get(session._id)
+    if state is not None:
+        end_session(state)
 
 
 title="ERNIE-ViLG"
@@ -278,7 +406,8 @@ with block:
         '卡通(Cartoon)', '二次元(Anime)', '浮世绘(Ukiyoe)', '蒸汽波艺术(Vaporwave)', 'low poly', 
         '像素风格(Pixel Style)', '概念艺术(Conceptual Art)', '未来主义(Futurism)', '赛博朋克(Cyberpunk)', '写实风格(Realistic style)', 
         '洛丽塔风格(Lolita style)', '巴洛克风格(Baroque style)', '超现实主义(Surrealism)', '探索无限(Explore infinity)'], value='探索无限(Explore infinity)', type="index")
-        gallery = gr.Gallery(
+        fresh = gr.Checkbox(label="重新生成(Regenerate, skip cached images)", value=False)
+        gallery = FileGallery(
             label="Generated images", show_label=False, elem_id="gallery"
         ).style(grid=[1, 4], height="auto")
         status_text = gr.Textbox(
@@ -287,16 +416,16 @@ with block:
             max_lines=1,
             interactive=False
         )
-        trigger_component = gr.Textbox(vaule="", visible=False) # This component is used for triggering inference funtion.
-        translated_language = gr.Textbox(vaule="", visible=False)
         
-        ex = gr.Examples(examples=examples, fn=translate_language, inputs=[text], outputs=[language_tips_text, status_text, trigger_component, translated_language], cache_examples=False)
+        ex = gr.Examples(examples=examples, inputs=[text], cache_examples=False)
         ex.dataset.headers = [""]
 
         
-        text.submit(translate_language, inputs=[text], outputs=[language_tips_text, status_text, trigger_component, translated_language])
-        btn.click(translate_language, inputs=[text], outputs=[language_tips_text, status_text, trigger_component, translated_language])
-        trigger_component.change(fn=inference, inputs=[translated_language, styles], outputs=[status_text, gallery])
+        # Per-browser-session state shared by that session's jobs, so a resubmit stops the previous one.
+        session = gr.State({})
+        text.submit(generate, inputs=[text, styles, fresh, session], outputs=[language_tips_text, status_text, gallery])
+        btn.click(generate, inputs=[text, styles, fresh, session], outputs=[language_tips_text, status_text, gallery])
+        block.load(readiness, outputs=[status_text], queue=False)
         gr.HTML(
             """
                 <div class="prompt">
@@ -359,4 +488,27 @@ In "Explore infinity" style mode, how the image looks like is totally up to your
         </div>
         ''')
 
-block.queue(concurrency_count=128).launch()
\ No newline at end of file
+
+def launch(concurrency_count=128, max_session_jobs=1, **kwargs):
+    block.queue(concurrency_count=concurrency_count)
+    # Each browser session gets at most `max_session_jobs` of the workers, a resubmit
+    # replaces the session's earlier jobs, and sessions are served round-robin.
+    scheduler = SessionQueue(block._queue, max_active=max_session_jobs,
+                             on_resubmit=stop_session, on_disconnect=stop_session)
+    pipeline.metrics.register(scheduler.collect)
+    pipeline.metrics.describe('session_jobs_superseded_total', 'Running jobs stopped because their session resubmitted.')
+    pipeline.metrics.describe('session_jobs_dropped_total', 'Queued jobs dropped because their session resubmitted.')
+    pipeline.metrics.instrument_queue(block._queue)
+    block.launch(prevent_thread_lock=True, **kwargs)
+    # Gradio creates the server app in launch(), so routes can only be added afterwards.
+    block.server_app.add_api_route('/health', health, methods=['GET'])
+    block.server_app.add_api_route('/metrics', metrics, methods=['GET'])
+    block.server_app.add_api_route('/trace/{trace_id}', trace, methods=['GET'])
+    if enable_profiler:
+        block.server_app.add_api_route('/debug/profile', profile, methods=['GET'])
+    return block
+
+
+if __name__ == '__main__':
+    launch()
+    block.block_thread()
\ No newline at end of file
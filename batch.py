@@ -0,0 +1,208 @@
+"""
+Headless batch generation: run every prompt (x style) of a JSONL or CSV file through
+the same translation and generation pipeline as the app.
+
+Each input row has a `prompt` and optionally a `style` (a style_list entry, the
+dropdown label such as '油画(Oil painting)', or an index) and an `id`. Rows without a
+style are generated once per `--styles` entry. Images and a manifest.jsonl line are
+written as each row finishes; rerunning with the same output directory skips rows
+that already succeeded.
+
+    python batch.py prompts.jsonl --output batch_output --workers 8 --styles 油画,水彩
+"""
+import argparse
+import csv
+import hashlib
+import json
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+import pipeline
+from result_cache import image_ext, normalize_prompt
+
+
+def parse_style(value):
+    if isinstance(value, int) or str(value).strip().isdigit():
+        index = int(value)
+        if not 0 <= index < len(pipeline.style_list):
+            raise ValueError('Style index out of range: %s' % value)
+        return index
+    name = str(value).split('(')[0].strip()
+    if name not in pipeline.style_list:
+        raise ValueError('Unknown style: %s' % value)
+    return pipeline.style_list.index(name)
+
+
+def read_records(path):
+    with open(path, encoding='utf-8') as f:
+        if path.endswith('.csv'):
+            return list(csv.DictReader(f))
+        records = []
+        for line in f:
+            line = line.strip()
+            if line:
+                record = json.loads(line)
+                records.append(record if isinstance(record, dict) else {'prompt': record})
+        return records
+
+
+def load_rows(path, styles):
+    """
+    One row per record and style. A record that cannot be run, e.g. with an unknown
+    style, still gets a row carrying the `error`, so it is reported in the manifest
+    instead of aborting the batch.
+    """
+    rows = []
+    for n, record in enumerate(read_records(path)):
+        prompt = str(record.get('prompt') or '').strip()
+        row_styles = [record['style']] if record.get('style') not in (None, '') else styles
+        for style in row_styles:
+            row = {'prompt': prompt}
+            try:
+                if not prompt:
+                    raise ValueError('Missing prompt')
+                row['style_indx'] = parse_style(style)
+                label = '%d' % row['style_indx']
+            except ValueError as e:
+                row['error'] = 'Record %d: %s' % (n + 1, e)
+                label = str(style)
+            digest = hashlib.sha1(('%s\0%s' % (prompt, label)).encode('utf-8')).hexdigest()[:10]
+            row['id'] = '%s-%s' % (record['id'], label) if record.get('id') else '%06d-%s' % (n, digest)
+            rows.append(row)
+    return rows
+
+
+def completed_ids(manifest_path):
+    done = set()
+    if os.path.exists(manifest_path):
+        with open(manifest_path, encoding='utf-8') as f:
+            for line in f:
+                try:
+                    entry = json.loads(line)
+                except ValueError:
+                    # A line cut short by a crash; that row simply runs again.
+                    continue
+                if entry.get('status') == 'ok':
+                    done.add(entry['id'])
+    return done
+
+
+class StageTimer(object):
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.samples = {}
+
+    def record(self, stage, seconds):
+        with self._lock:
+            self.samples.setdefault(stage, []).append(seconds)
+
+    def summary(self):
+        result = {}
+        with self._lock:
+            for stage, values in self.samples.items():
+                values = sorted(values)
+                result[stage] = {
+                    'count': len(values),
+                    'p50': values[int(0.50 * (len(values) - 1))],
+                    'p95': values[int(0.95 * (len(values) - 1))],
+                }
+        return result
+
+
+def run_batch(rows, output_dir, workers=8, fresh=False, topk=4):
+    image_dir = os.path.join(output_dir, 'images')
+    os.makedirs(image_dir, exist_ok=True)
+    manifest_path = os.path.join(output_dir, 'manifest.jsonl')
+    done = completed_ids(manifest_path)
+    pending = [row for row in rows if row['id'] not in done]
+    timer = StageTimer()
+    manifest_lock = threading.Lock()
+    counts = {'ok': 0, 'error': 0, 'images': 0, 'skipped': len(rows) - len(pending)}
+    start = time.perf_counter()
+
+    # Translate each distinct prompt once, however many rows and styles share it.
+    translations = {}
+
+    def translate(prompt):
+        begin = time.perf_counter()
+        try:
+            translations[normalize_prompt(prompt)] = pipeline.translate_language(prompt)
+        except Exception as e:
+            translations[normalize_prompt(prompt)] = e
+        timer.record('translate', time.perf_counter() - begin)
+
+    prompts = {normalize_prompt(row['prompt']): row['prompt'] for row in pending if 'error' not in row}
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        list(pool.map(translate, prompts.values()))
+
+    def generate(row):
+        entry = {'id': row['id'], 'prompt': row['prompt']}
+        try:
+            if 'error' in row:
+                raise ValueError(row['error'])
+            entry['style'] = pipeline.style_list[row['style_indx']]
+            translated = translations[normalize_prompt(row['prompt'])]
+            if isinstance(translated, Exception):
+                raise translated
+            entry['translated'], entry['language'] = translated
+            begin = time.perf_counter()
+            images = pipeline.submit_inference(entry['translated'], row['style_indx'], fresh, topk).result()
+            timer.record('generate', time.perf_counter() - begin)
+            begin = time.perf_counter()
+            entry['images'] = []
+            for i, data in enumerate(images):
+                name = '%s_%d%s' % (row['id'], i, image_ext(data))
+                with open(os.path.join(image_dir, name), 'wb') as f:
+                    f.write(data)
+                entry['images'].append(os.path.join('images', name))
+            timer.record('write', time.perf_counter() - begin)
+            entry['status'] = 'ok'
+        except Exception as e:
+            entry['status'] = 'error'
+            entry['error'] = str(e)
+        with manifest_lock:
+            with open(manifest_path, 'a', encoding='utf-8') as f:
+                f.write(json.dumps(entry, ensure_ascii=False) + '\n')
+            counts[entry['status']] += 1
+            counts['images'] += len(entry.get('images', ()))
+        return entry
+
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        for future in as_completed([pool.submit(generate, row) for row in pending]):
+            entry = future.result()
+            print('[%d/%d] %s %s' % (counts['ok'] + counts['error'], len(pending), entry['status'], entry['id']))
+
+    elapsed = time.perf_counter() - start
+    summary = dict(counts, rows=len(rows), unique_prompts=len(prompts), seconds=elapsed,
+                   images_per_minute=counts['images'] / elapsed * 60 if elapsed else 0.0,
+                   stages=timer.summary())
+    with open(os.path.join(output_dir, 'summary.json'), 'w', encoding='utf-8') as f:
+        json.dump(summary, f, indent=2, ensure_ascii=False)
+    return summary
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Generate images for every prompt in a JSONL or CSV file.')
+    parser.add_argument('input')
+    parser.add_argument('--output', default='batch_output')
+    parser.add_argument('--workers', type=int, default=8)
+    parser.add_argument('--styles', default='探索无限', help='comma separated styles for rows without one')
+    parser.add_argument('--topk', type=int, default=4)
+    parser.add_argument('--fresh', action='store_true', help='ignore cached results')
+    args = parser.parse_args()
+
+    pipeline.modules.warm()
+    rows = load_rows(args.input, [style for style in args.styles.split(',') if style])
+    summary = run_batch(rows, args.output, args.workers, args.fresh, args.topk)
+    print('%d ok, %d failed, %d skipped, %d images in %.1fs (%.1f images/min)' % (
+        summary['ok'], summary['error'], summary['skipped'], summary['images'], summary['seconds'],
+        summary['images_per_minute']))
+    for stage, stats in sorted(summary['stages'].items()):
+        print('  %-10s n=%-5d p50=%.3fs p95=%.3fs' % (stage, stats['count'], stats['p50'], stats['p95']))
+
+
+if __name__ == '__main__':
+    main()
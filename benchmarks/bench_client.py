@@ -0,0 +1,102 @@
+"""
+Throughput of the asyncio ErnieVilGClient against the local HTTP stand-in for the
+generation API, compared with blocking thread-per-request polling in the style of the
+ernie_vilg PaddleHub module (a fresh connection per call, fixed poll interval).
+
+    python benchmarks/bench_client.py --requests 256 --latency 2
+"""
+import argparse
+import asyncio
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+
+from common import percentile, print_results
+from ernie_client import ErnieVilGClient
+from token_manager import TokenManager
+import fakes
+
+
+def blocking_generate(api_url, token, text, style, topk, poll_interval):
+    res = requests.post(api_url + '/txt2img', data={'access_token': token, 'text': text, 'style': style}).json()
+    task_id = res['data']['taskId']
+    while True:
+        res = requests.post(api_url + '/getImg', data={'access_token': token, 'taskId': task_id}).json()
+        if res['data']['status'] == 1:
+            break
+        time.sleep(poll_interval)
+    return [requests.get(item['image']).content for item in res['data']['imgUrls'][:topk]]
+
+
+def report(name, server, before, latencies, elapsed, threads):
+    print_results(name, [
+        ('generations', len(latencies)),
+        ('throughput (gen/s)', len(latencies) / elapsed),
+        ('latency p50 (s)', percentile(latencies, 50)),
+        ('latency p95 (s)', percentile(latencies, 95)),
+        ('HTTP requests', server.requests - before[0]),
+        ('connections opened', server.connections - before[1]),
+        ('peak threads', threads),
+    ])
+
+
+def run_blocking(server, token, args):
+    before = (server.requests, server.connections)
+    latencies = []
+    peak = [threading.active_count()]
+
+    def one(i):
+        start = time.perf_counter()
+        blocking_generate(server.base_url, token, 'prompt %d' % i, '油画', 4, args.poll_interval)
+        latencies.append(time.perf_counter() - start)
+        peak[0] = max(peak[0], threading.active_count())
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=args.concurrency) as pool:
+        list(pool.map(one, range(args.requests)))
+    report('blocking, thread per request', server, before, latencies, time.perf_counter() - start, peak[0])
+
+
+def run_async(server, token_manager, args):
+    client = ErnieVilGClient(token_manager, api_url=server.base_url, max_concurrency=args.concurrency,
+                             max_connections=args.connections, min_poll_interval=args.poll_interval)
+    before = (server.requests, server.connections)
+    latencies = []
+
+    async def one(i):
+        start = time.perf_counter()
+        await client.generate_image('prompt %d' % i, '油画', 4)
+        latencies.append(time.perf_counter() - start)
+
+    async def main():
+        await asyncio.gather(*[one(i) for i in range(args.requests)])
+        await client.close()
+
+    start = time.perf_counter()
+    asyncio.run(main())
+    report('asyncio client, shared pool', server, before, latencies, time.perf_counter() - start,
+           threading.active_count())
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--requests', type=int, default=256)
+    parser.add_argument('--concurrency', type=int, default=128)
+    parser.add_argument('--connections', type=int, default=32)
+    parser.add_argument('--latency', type=float, default=2.0)
+    parser.add_argument('--jitter', type=float, default=1.0)
+    parser.add_argument('--poll-interval', type=float, default=0.2)
+    args = parser.parse_args()
+
+    model = fakes.FakeErnieVilG(latency=args.latency, jitter=args.jitter)
+    server = fakes.FakeErnieVilGServer(model).start()
+    token_manager = TokenManager(model)
+    run_blocking(server, token_manager.get(), args)
+    run_async(server, token_manager, args)
+    server.stop()
+
+
+if __name__ == '__main__':
+    main()
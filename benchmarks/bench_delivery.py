@@ -0,0 +1,95 @@
+"""
+Cost of handing generated images to the gallery: decoding the API's JPEGs into PIL
+images (what the original inference() returned, re-encoded by Gradio as PNG) against
+passing the cached compressed files by path, or low-resolution JPEG previews of them.
+
+Reports per request the bytes the browser has to download, server CPU time and the
+peak RSS growth (sampled from /proc, so Linux only) between "API bytes in hand" and
+"gallery value ready".
+
+    python benchmarks/bench_delivery.py --requests 20 --size 1024
+"""
+import argparse
+import io
+import json
+import os
+import tempfile
+import time
+
+import gradio as gr
+from PIL import Image
+
+from common import RssSampler, print_results
+from delivery import compress
+from result_cache import ResultCache, decode_image
+import fakes
+
+
+def make_preview(data, max_side=256, quality=60):
+    image = Image.open(io.BytesIO(data))
+    # For JPEG this lets the decoder scale down while decoding instead of afterwards.
+    image.draft('RGB', (max_side, max_side))
+    image = image.convert('RGB')
+    image.thumbnail((max_side, max_side))
+    buffer = io.BytesIO()
+    image.save(buffer, format='JPEG', quality=quality)
+    return buffer.getvalue()
+
+
+def measure(name, deliver, requests, gallery):
+    payloads = []
+    cpu = []
+    peaks = []
+    for i in range(requests):
+        with RssSampler() as sampler:
+            start = time.process_time()
+            value = gallery.postprocess(deliver(i))
+            cpu.append(time.process_time() - start)
+        peaks.append(sampler.peak - sampler.baseline)
+        files = sum(os.path.getsize(item['name']) for item in value)
+        payloads.append(files + len(json.dumps(value)))
+    return name, [
+        ('payload per request (KiB)', sum(payloads) / len(payloads) / 1024.0),
+        ('as base64 JSON, Gradio 3.1 (KiB)', sum(payloads) / len(payloads) * 4 / 3 / 1024.0),
+        ('server CPU per request (ms)', sum(cpu) / len(cpu) * 1000),
+        ('peak RSS growth (MiB)', sum(peaks) / len(peaks) / 2.0**20),
+    ]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--requests', type=int, default=20)
+    parser.add_argument('--size', type=int, default=1024)
+    parser.add_argument('--topk', type=int, default=4)
+    args = parser.parse_args()
+
+    server = fakes.FakeErnieVilGServer(fakes.FakeErnieVilG(image_size=(args.size, args.size)))
+    api_images = [server.image_bytes(i) for i in range(args.topk)]
+    cache = ResultCache(tempfile.mkdtemp(prefix='ernievilg-bench-'))
+    gallery = gr.Gallery()
+
+    def decoded(i):
+        return [decode_image(data) for data in api_images]
+
+    def by_path(i):
+        key = 'request%d' % i
+        cache.put(key, [compress(data) for data in api_images])
+        return cache.paths(key)
+
+    def preview(i):
+        preview_dir = tempfile.mkdtemp(prefix='ernievilg-preview-')
+        paths = []
+        for n, data in enumerate(api_images):
+            paths.append(os.path.join(preview_dir, '%d.jpg' % n))
+            with open(paths[-1], 'wb') as f:
+                f.write(make_preview(data))
+        return paths
+
+    for name, rows in (measure('decoded PIL images (original)', decoded, args.requests, gallery),
+                       measure('compressed files by path', by_path, args.requests, gallery),
+                       measure('low-resolution previews', preview, args.requests, gallery)):
+        print_results(name, rows)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,102 @@
+"""
+Overhead of the pipeline instrumentation: the cost of one Metrics.timed() block against
+a bare call, single-threaded and under contention, the cost of rendering /metrics, and
+end-to-end throughput of translate + generate against the fakes with metrics disabled,
+enabled, and enabled with the sampling profiler running.
+
+    python benchmarks/bench_metrics.py --calls 200000 --requests 400
+"""
+import argparse
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from common import load_pipeline, percentile, print_results
+from metrics import Metrics, SamplingProfiler, new_trace_id
+import fakes
+
+
+def per_call(fn, calls, threads):
+    def run():
+        for _ in range(calls // threads):
+            fn()
+
+    workers = [threading.Thread(target=run) for _ in range(threads)]
+    start = time.perf_counter()
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        worker.join()
+    return (time.perf_counter() - start) / calls * 1e9
+
+
+def micro(args):
+    metrics = Metrics()
+
+    def bare():
+        pass
+
+    def timed():
+        with metrics.timed('generate', '油画', 'abcdef0123456789'):
+            pass
+
+    rows = []
+    for threads in (1, 8):
+        baseline = per_call(bare, args.calls, threads)
+        rows.append(('bare call, %d thread(s) (ns)' % threads, baseline))
+        rows.append(('timed(), %d thread(s) (ns)' % threads, per_call(timed, args.calls, threads)))
+    metrics.enabled = False
+    rows.append(('timed() disabled (ns)', per_call(timed, args.calls, 1)))
+    start = time.perf_counter()
+    for _ in range(100):
+        metrics.render()
+    rows.append(('render /metrics (ms)', (time.perf_counter() - start) * 10))
+    print_results('per call', rows)
+
+
+def end_to_end(pipeline, args):
+    results = []
+    for name, enabled, profile in (('metrics disabled', False, False),
+                                   ('metrics enabled', True, False),
+                                   ('metrics enabled + profiler', True, True)):
+        pipeline.metrics.enabled = enabled
+        profiler = SamplingProfiler().start() if profile else None
+        tag = name.replace(' ', '-')
+        latencies = []
+
+        def one(i):
+            trace_id = new_trace_id()
+            start = time.perf_counter()
+            text, _ = pipeline.translate_language('a cat %s %d' % (tag, i), trace_id)
+            pipeline.submit_inference(text, 1, trace_id=trace_id).result()
+            latencies.append(time.perf_counter() - start)
+
+        start = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=args.concurrency) as pool:
+            list(pool.map(one, range(args.requests)))
+        elapsed = time.perf_counter() - start
+        if profiler is not None:
+            profiler.stop()
+        print_results(name, [
+            ('throughput (req/s)', args.requests / elapsed),
+            ('latency p50 (ms)', percentile(latencies, 50) * 1000),
+            ('latency p95 (ms)', percentile(latencies, 95) * 1000),
+        ])
+        results.append(elapsed)
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--calls', type=int, default=200000)
+    parser.add_argument('--requests', type=int, default=400)
+    parser.add_argument('--concurrency', type=int, default=32)
+    args = parser.parse_args()
+
+    micro(args)
+    pipeline, _ = load_pipeline(ernie_vilg=fakes.FakeErnieVilG(latency=0.01), poll_interval=0.01)
+    end_to_end(pipeline, args)
+
+
+if __name__ == '__main__':
+    main()
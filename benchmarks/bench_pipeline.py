@@ -0,0 +1,103 @@
+"""
+Compare the old two-event chain (translate_language job -> frontend -> trigger_component
+.change -> inference job) with the single pipelined `generate` handler in app.py.
+
+The Gradio queue is modelled as a pool of `--concurrency` workers; the old chain pays a
+browser round trip (`--rtt`) between its two jobs and queues twice.
+
+    python benchmarks/bench_pipeline.py --requests 200 --concurrency 16
+"""
+import argparse
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from common import example_prompts, inference, load_pipeline, percentile, print_results
+import fakes
+
+
+class SimulatedQueue(object):
+
+    def __init__(self, concurrency):
+        self.pool = ThreadPoolExecutor(max_workers=concurrency)
+        self.jobs = 0
+        self.waits = []
+        self.busy = 0.0
+        self._lock = threading.Lock()
+
+    def run(self, fn, *args):
+        submitted = time.perf_counter()
+
+        def job():
+            started = time.perf_counter()
+            try:
+                return fn(*args)
+            finally:
+                finished = time.perf_counter()
+                with self._lock:
+                    self.jobs += 1
+                    self.waits.append(started - submitted)
+                    self.busy += finished - started
+
+        return self.pool.submit(job).result()
+
+
+def old_chain(pipeline, queue, rtt, prompt, style_indx):
+    text_prompts, _ = queue.run(pipeline.translate_language, prompt)
+    # The response travels to the browser, trigger_component.change fires and rejoins the queue.
+    time.sleep(rtt)
+    queue.run(inference, pipeline, text_prompts, style_indx, True)
+
+
+def new_pipeline(app, queue, rtt, prompt, style_indx):
+    queue.run(lambda: list(app.generate(prompt, style_indx, True)))
+
+
+def run(name, request, target, args, prompts):
+    queue = SimulatedQueue(args.concurrency)
+    latencies = []
+    lock = threading.Lock()
+
+    def client(i):
+        start = time.perf_counter()
+        request(target, queue, args.rtt, prompts[i % len(prompts)] + ' %d' % i, 16)
+        with lock:
+            latencies.append(time.perf_counter() - start)
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=args.requests) as clients:
+        list(clients.map(client, range(args.requests)))
+    elapsed = time.perf_counter() - start
+    queue.pool.shutdown()
+    print_results(name, [
+        ('requests', args.requests),
+        ('throughput (req/s)', args.requests / elapsed),
+        ('latency p50 (s)', percentile(latencies, 50)),
+        ('latency p95 (s)', percentile(latencies, 95)),
+        ('queue jobs per request', queue.jobs / float(args.requests)),
+        ('queue wait mean (s)', sum(queue.waits) / len(queue.waits)),
+        ('slot-seconds per request', queue.busy / args.requests),
+    ])
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--requests', type=int, default=200)
+    parser.add_argument('--concurrency', type=int, default=16)
+    parser.add_argument('--rtt', type=float, default=0.05, help='browser round trip between chained events')
+    parser.add_argument('--translate-latency', type=float, default=0.05)
+    parser.add_argument('--generate-latency', type=float, default=0.3)
+    args = parser.parse_args()
+
+    pipeline, _ = load_pipeline(
+        ernie_vilg=fakes.FakeErnieVilG(latency=args.generate_latency),
+        translate=fakes.FakeTranslate(latency=args.translate_latency),
+        recognition=fakes.FakeLanguageRecognition(latency=args.translate_latency))
+    import app
+    prompts = example_prompts()
+    run('before: translate -> trigger -> inference', old_chain, pipeline, args, prompts)
+    run('after: single pipelined handler', new_pipeline, app, args, prompts)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,76 @@
+"""
+Load test for request coalescing: many concurrent users asking for a handful of hot
+prompts against a latency-injecting fake ernie_vilg, with and without SingleFlight.
+
+    python benchmarks/bench_single_flight.py --users 256 --hot-prompts 4
+"""
+import argparse
+import random
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from common import example_prompts, inference, load_pipeline, percentile, print_results
+import fakes
+
+
+def run(name, call, model, args, prompts):
+    rng = random.Random(args.seed)
+    requests = [rng.choice(prompts) for _ in range(args.users)]
+    calls_before = model.generate_calls
+    latencies = []
+    errors = []
+
+    def user(prompt):
+        # Spread arrivals over the first part of a generation so requests overlap.
+        time.sleep(rng.uniform(0, args.arrival_window))
+        start = time.perf_counter()
+        try:
+            call(prompt)
+        except Exception as e:
+            errors.append(type(e).__name__)
+        latencies.append(time.perf_counter() - start)
+
+    with ThreadPoolExecutor(max_workers=args.users) as pool:
+        list(pool.map(user, requests))
+    print_results(name, [
+        ('user requests', args.users),
+        ('upstream generate calls', model.generate_calls - calls_before),
+        ('errors', len(errors)),
+        ('latency p50 (s)', percentile(latencies, 50)),
+        ('latency p95 (s)', percentile(latencies, 95)),
+    ])
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--users', type=int, default=256)
+    parser.add_argument('--hot-prompts', type=int, default=4)
+    parser.add_argument('--latency', type=float, default=1.0, help='upstream generation latency (s)')
+    parser.add_argument('--jitter', type=float, default=0.5)
+    parser.add_argument('--arrival-window', type=float, default=0.5)
+    parser.add_argument('--max-waiters', type=int, default=32)
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+
+    model = fakes.FakeErnieVilG(latency=args.latency, jitter=args.jitter)
+    pipeline, _ = load_pipeline(ernie_vilg=model)
+    pipeline.generations.max_waiters = args.max_waiters
+    pipeline.client.max_concurrency = args.users
+    prompts = example_prompts()[:args.hot_prompts]
+    style_indx = 16
+    style = pipeline.style_list[style_indx]
+
+    def uncoalesced(prompt):
+        pipeline.background_loop.run(pipeline.client.generate_image(prompt, style, 4))
+
+    run('without coalescing', uncoalesced, model, args, prompts)
+    run('with SingleFlight', lambda prompt: inference(pipeline, prompt, style_indx, fresh=True), model, args, prompts)
+    print_results('single-flight counters', [
+        ('leader calls', pipeline.generations.calls),
+        ('shared waits', pipeline.generations.shared),
+        ('overflowed (waiter cap)', pipeline.generations.overflowed),
+    ])
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,116 @@
+"""
+Cold start of app.py with the PaddleHub modules loaded lazily and warmed concurrently,
+against the original order of loading them one after another before building the UI.
+
+Every run starts a fresh interpreter and reports, from process start, when the UI
+answers on / and when /health reports the modules ready, plus the load time of each
+module. By default the modules are fakes that take --load-latency seconds to load
+(ernie_vilg, baidu_translate, baidu_language_recognition); --paddlehub loads the real
+ones.
+
+    python benchmarks/bench_startup.py --load-latency 6,3,2 --runs 3
+"""
+import argparse
+import json
+import os
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+
+START = time.perf_counter()
+
+from common import ROOT, print_results, write_json
+
+NAMES = ['ernie_vilg', 'baidu_translate', 'baidu_language_recognition']
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+def wait_for(url, deadline=300.0):
+    import requests
+    while time.perf_counter() - START < deadline:
+        try:
+            if requests.get(url, timeout=5).status_code == 200:
+                return time.perf_counter() - START
+        except requests.ConnectionError:
+            pass
+        time.sleep(0.02)
+    raise RuntimeError('%s not ready after %ds' % (url, deadline))
+
+
+def child(args):
+    os.chdir(tempfile.mkdtemp(prefix='ernievilg-bench-'))
+    if not args.paddlehub:
+        import fakes
+        fakes.install(load_latency=dict(zip(NAMES, args.load_latency)))
+    import pipeline
+    result = {}
+    if args.child == 'eager':
+        # What app.py used to do: load every module on the main thread before the UI exists.
+        for name in NAMES:
+            pipeline.modules.get(name)
+    import app
+    result['ui_built'] = time.perf_counter() - START
+    port = free_port()
+    app.launch(server_port=port, quiet=True)
+    base_url = 'http://127.0.0.1:%d' % port
+    result['serving'] = wait_for(base_url + '/')
+    result['ready'] = wait_for(base_url + '/health')
+    result['modules'] = dict((name, status['seconds'])
+                             for name, status in pipeline.modules.status()['modules'].items())
+    app.block.close()
+    print(json.dumps(result))
+
+
+def run(mode, args):
+    command = [sys.executable, os.path.abspath(__file__), '--child', mode,
+               '--load-latency', ','.join(str(value) for value in args.load_latency)]
+    if args.paddlehub:
+        command.append('--paddlehub')
+    results = []
+    for _ in range(args.runs):
+        output = subprocess.run(command, check=True, capture_output=True, text=True, cwd=ROOT).stdout
+        results.append(json.loads(output.strip().splitlines()[-1]))
+    return results
+
+
+def mean(values):
+    return sum(values) / len(values)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--runs', type=int, default=3)
+    parser.add_argument('--load-latency', default='6,3,2',
+                        type=lambda value: [float(part) for part in value.split(',')])
+    parser.add_argument('--paddlehub', action='store_true', help='load the real PaddleHub modules')
+    parser.add_argument('--json', help='also write the results to this file')
+    parser.add_argument('--child', choices=['eager', 'lazy'], help=argparse.SUPPRESS)
+    args = parser.parse_args()
+    if args.child:
+        return child(args)
+
+    results = {}
+    for mode, title in (('eager', 'sequential loading before the UI (original)'),
+                        ('lazy', 'lazy loading, warmed concurrently')):
+        results[mode] = run(mode, args)
+        rows = [
+            ('UI built (s)', mean([r['ui_built'] for r in results[mode]])),
+            ('UI serving (s)', mean([r['serving'] for r in results[mode]])),
+            ('/health ready (s)', mean([r['ready'] for r in results[mode]])),
+        ]
+        for name in NAMES:
+            rows.append(('%s (s)' % name, mean([r['modules'][name] for r in results[mode]])))
+        print_results(title, rows)
+    if args.json:
+        write_json(args.json, results)
+
+
+if __name__ == '__main__':
+    main()
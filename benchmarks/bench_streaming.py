@@ -0,0 +1,187 @@
+"""
+Progressive gallery streaming, measured through the real Gradio queue against the
+fakes: time until the first image reaches the client against time until all of them
+have, and how quickly upstream work stops when a client disconnects or resubmits.
+
+Before streaming, the first image arrived together with the last one, so the
+difference between the two columns is what streaming saves. Each image download takes
+--download-latency seconds (or a fakes.parse_latency() spec).
+
+    python benchmarks/bench_streaming.py --requests 20 --download-latency uniform:0.2,2
+"""
+import argparse
+import asyncio
+import json
+import socket
+import time
+import uuid
+
+from common import load_pipeline, percentile, print_results, write_json
+import fakes
+
+STYLE = '油画(Oil painting)'
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+def has_images(output):
+    gallery = output.get('data', [None, None, None])[2]
+    return isinstance(gallery, list) and len(gallery) > 0
+
+
+async def submit(url, fn_index, prompt, session_hash=None, on_message=None):
+    """Run one request; return `{message: seconds}` for the first of each message type."""
+    import websockets
+    session_hash = session_hash or uuid.uuid4().hex
+    start = time.perf_counter()
+    times = {}
+    async with websockets.connect(url, max_size=None, open_timeout=60) as websocket:
+        async for message in websocket:
+            message = json.loads(message)
+            now = time.perf_counter() - start
+            if message['msg'] == 'send_hash':
+                await websocket.send(json.dumps({'session_hash': session_hash, 'fn_index': fn_index}))
+            elif message['msg'] == 'send_data':
+                await websocket.send(json.dumps({'session_hash': session_hash, 'fn_index': fn_index,
+                                                 'data': [prompt, STYLE, False, None]}))
+            elif message['msg'] == 'process_generating' and has_images(message['output']):
+                times.setdefault('first_image', now)
+            elif message['msg'] == 'process_completed':
+                times['completed'] = now
+                times['status'] = message['output'].get('data', [None, None])[1]
+                if has_images(message['output']):
+                    times.setdefault('first_image', now)
+                return times
+            times.setdefault(message['msg'], now)
+            if on_message is not None and await on_message(message, websocket):
+                return times
+    return times
+
+
+async def wait_idle(pipeline, timeout=30.0):
+    """Seconds until no generation is running upstream."""
+    start = time.perf_counter()
+    while pipeline.generations.in_flight():
+        if time.perf_counter() - start > timeout:
+            raise RuntimeError('generation still running after %ds' % timeout)
+        await asyncio.sleep(0.005)
+    return time.perf_counter() - start
+
+
+async def first_vs_all(url, fn_index, args):
+    first, complete = [], []
+
+    async def one(i):
+        await asyncio.sleep(i * args.interval)
+        times = await submit(url, fn_index, 'streaming %d' % i)
+        if times.get('status') == 'Success':
+            first.append(times['first_image'])
+            complete.append(times['completed'])
+
+    await asyncio.gather(*[one(i) for i in range(args.requests)])
+    return first, complete
+
+
+async def disconnect(url, fn_index, pipeline):
+    """Close the socket as soon as the first image is in; time until upstream work stops."""
+    async def close_on_first_image(message, websocket):
+        if message['msg'] == 'process_generating' and has_images(message['output']):
+            await websocket.close()
+            return True
+
+    await submit(url, fn_index, 'disconnect %s' % uuid.uuid4().hex, on_message=close_on_first_image)
+    return await wait_idle(pipeline)
+
+
+async def resubmit(url, fn_index, pipeline):
+    """Submit twice from one session; time until the first job is done after the second starts."""
+    session_hash = uuid.uuid4().hex
+    started = asyncio.Event()
+
+    async def second_after_start(message, websocket):
+        if message['msg'] == 'process_starts':
+            started.set()
+
+    async def second():
+        await started.wait()
+        # Let the first job reach the generation stage before superseding it.
+        await asyncio.sleep(0.2)
+        resubmitted = time.perf_counter()
+        task = asyncio.ensure_future(submit(url, fn_index, 'resubmit b %s' % session_hash, session_hash))
+        return resubmitted, task
+
+    first = asyncio.ensure_future(submit(url, fn_index, 'resubmit a %s' % session_hash, session_hash,
+                                         second_after_start))
+    resubmitted, task = await second()
+    await first
+    stopped = time.perf_counter() - resubmitted
+    times = await task
+    return stopped, times.get('status')
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--requests', type=int, default=20)
+    parser.add_argument('--interval', type=float, default=0.1, help='seconds between request starts')
+    parser.add_argument('--generate-latency', default='1.0')
+    parser.add_argument('--download-latency', default='uniform:0.2,2')
+    parser.add_argument('--image-size', type=int, default=1024)
+    parser.add_argument('--repeat', type=int, default=5, help='disconnect and resubmit runs')
+    parser.add_argument('--json', help='also write the results to this file')
+    args = parser.parse_args()
+
+    pipeline, _ = load_pipeline(
+        ernie_vilg=fakes.FakeErnieVilG(latency=args.generate_latency, image_size=(args.image_size, args.image_size)),
+        download_latency=args.download_latency)
+    import app
+    port = free_port()
+    app.launch(server_port=port, quiet=True)
+    fn_index = [i for i, dependency in enumerate(app.block.dependencies)
+                if dependency['targets'] == [app.btn._id] and dependency['trigger'] == 'click'][0]
+    url = 'ws://127.0.0.1:%d/queue/join' % port
+
+    async def run():
+        await submit(url, fn_index, 'warm up')
+        first, complete = await first_vs_all(url, fn_index, args)
+        stops = [await disconnect(url, fn_index, pipeline) for _ in range(args.repeat)]
+        resubmits = [await resubmit(url, fn_index, pipeline) for _ in range(args.repeat)]
+        return first, complete, stops, resubmits
+
+    first, complete, stops, resubmits = asyncio.run(run())
+    app.block.close()
+    results = {
+        'completed': len(complete),
+        'first_image_p50': percentile(first, 50),
+        'first_image_p95': percentile(first, 95),
+        'all_images_p50': percentile(complete, 50),
+        'all_images_p95': percentile(complete, 95),
+        'disconnect_stop_p50': percentile(stops, 50),
+        'disconnect_stop_max': max(stops),
+        'resubmit_stop_p50': percentile([stop for stop, _ in resubmits], 50),
+        'resubmit_stop_max': max(stop for stop, _ in resubmits),
+        'resubmit_newer_succeeded': sum(status == 'Success' for _, status in resubmits),
+    }
+    print_results('time to first image vs all images', [
+        ('completed / requests', '%d / %d' % (len(complete), args.requests)),
+        ('first image p50 (s)', results['first_image_p50']),
+        ('first image p95 (s)', results['first_image_p95']),
+        ('all images p50 (s)', results['all_images_p50']),
+        ('all images p95 (s)', results['all_images_p95']),
+    ])
+    print_results('stopping upstream work', [
+        ('after disconnect p50 (s)', results['disconnect_stop_p50']),
+        ('after disconnect max (s)', results['disconnect_stop_max']),
+        ('superseded job done p50 (s)', results['resubmit_stop_p50']),
+        ('superseded job done max (s)', results['resubmit_stop_max']),
+        ('newer job succeeded', '%d / %d' % (results['resubmit_newer_succeeded'], args.repeat)),
+    ])
+    if args.json:
+        write_json(args.json, results)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,62 @@
+"""
+Check that an expired access token is refreshed once, not once per request: N
+concurrent ErnieVilGClient generations run against the local stand-in for the
+generation API right after all issued tokens were revoked, and every one must succeed
+with exactly one call to the token endpoint. Exits non-zero if not.
+
+    python benchmarks/check_tokens.py --requests 64
+"""
+import argparse
+import asyncio
+import sys
+
+from common import print_results
+from ernie_client import ErnieVilGClient
+from token_manager import TokenManager
+import fakes
+
+
+def run(model, server, token_manager, requests):
+    client = ErnieVilGClient(token_manager, api_url=server.base_url, min_poll_interval=0.05)
+
+    async def main():
+        try:
+            return await asyncio.gather(*[client.generate_image('prompt %d' % i, '油画', 1) for i in range(requests)],
+                                        return_exceptions=True)
+        finally:
+            await client.close()
+
+    before = model.token_calls
+    results = asyncio.run(main())
+    succeeded = sum(not isinstance(result, BaseException) for result in results)
+    return succeeded, model.token_calls - before
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--requests', type=int, default=64)
+    parser.add_argument('--token-latency', type=float, default=0.2, help='seconds the token endpoint takes')
+    args = parser.parse_args()
+
+    model = fakes.FakeErnieVilG(latency=0.1, token_latency=args.token_latency)
+    server = fakes.FakeErnieVilGServer(model).start()
+    token_manager = TokenManager(model)
+    rows = []
+    failed = False
+    for name, expire in (('valid token', False), ('token expired', True)):
+        if expire:
+            model.expire_tokens()
+        succeeded, token_calls = run(model, server, token_manager, args.requests)
+        expected = 1 if expire else 0
+        ok = succeeded == args.requests and token_calls == expected
+        failed = failed or not ok
+        rows.append(('%s: succeeded' % name, '%d / %d' % (succeeded, args.requests)))
+        rows.append(('%s: token calls' % name, '%d (expected %d)' % (token_calls, expected)))
+    server.stop()
+    print_results('concurrent generations and token refreshes', rows)
+    if failed:
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,114 @@
+import json
+import os
+import resource
+import sys
+import tempfile
+import threading
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+import fakes
+
+
+def load_pipeline(ernie_vilg=None, translate=None, recognition=None, poll_interval=0.05, download_latency=0.0):
+    """
+    Import pipeline against fake PaddleHub modules and a local stand-in for the
+    generation API, with its caches in a scratch directory so runs never see each
+    other's results.
+    """
+    os.chdir(tempfile.mkdtemp(prefix='ernievilg-bench-'))
+    os.environ['ERNIEVILG_DATA_DIR'] = os.getcwd()
+    modules = fakes.install(ernie_vilg, translate, recognition)
+    server = fakes.FakeErnieVilGServer(modules['ernie_vilg'], download_latency=download_latency).start()
+    os.environ['ERNIE_VILG_API_URL'] = server.base_url
+    import pipeline
+    pipeline.client.min_poll_interval = poll_interval
+    modules['server'] = server
+    return pipeline, modules
+
+
+def inference(pipeline, text_prompts, style_indx, fresh=False, topk=4):
+    """
+    Blocking pipeline.submit_inference() returning decoded images, like the original
+    inference() handler did.
+    """
+    from result_cache import decode_image
+    future = pipeline.submit_inference(text_prompts, style_indx, fresh, topk)
+    try:
+        images = future.result()
+    except BaseException:
+        future.cancel()
+        raise
+    return [decode_image(data) for data in images]
+
+
+def examples():
+    """The `[prompt, style label]` rows of the `examples` list in app.py, without importing gradio."""
+    import ast
+    with open(os.path.join(ROOT, 'app.py'), encoding='utf-8') as f:
+        tree = ast.parse(f.read())
+    for node in tree.body:
+        if isinstance(node, ast.Assign) and getattr(node.targets[0], 'id', None) == 'examples':
+            return ast.literal_eval(node.value)
+    raise RuntimeError('examples not found in app.py')
+
+
+def example_prompts():
+    return [row[0] for row in examples()]
+
+
+PAGE_SIZE = resource.getpagesize()
+
+
+def rss():
+    """Resident set size of this process in bytes, from /proc (Linux only)."""
+    with open('/proc/self/statm') as f:
+        return int(f.read().split()[1]) * PAGE_SIZE
+
+
+class RssSampler(object):
+    """Samples RSS every `interval` seconds on a background thread and keeps the peak."""
+
+    def __init__(self, interval=0.001):
+        self.interval = interval
+
+    def __enter__(self):
+        self.baseline = self.peak = rss()
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run)
+        self._thread.start()
+        return self
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            self.sample()
+
+    def sample(self):
+        self.peak = max(self.peak, rss())
+
+    def __exit__(self, *exc):
+        self._stop.set()
+        self._thread.join()
+        self.sample()
+
+
+def percentile(values, q):
+    if not values:
+        return float('nan')
+    values = sorted(values)
+    index = min(len(values) - 1, max(0, int(round(q / 100.0 * (len(values) - 1)))))
+    return values[index]
+
+
+def print_results(title, rows):
+    print(title)
+    for name, value in rows:
+        if isinstance(value, float):
+            value = '%.4f' % value
+        print('  %-32s %s' % (name, value))
+
+
+def write_json(path, results):
+    with open(path, 'w', encoding='utf-8') as f:
+        json.dump(results, f, indent=2, ensure_ascii=False, sort_keys=True)
@@ -0,0 +1,260 @@
+"""
+Load test of the app as deployed: the real `generate` handler behind the real Gradio
+queue, driven over the queue's websocket protocol like a browser, with the PaddleHub
+modules replaced by configurable fakes.
+
+Traffic mixes, each replayed in a fresh process so caches start cold:
+  repeat        Poisson arrivals, prompts drawn Zipf-like from a few hot examples
+  multilingual  Poisson arrivals cycling through the `examples` list (zh/en/jp/kor),
+                every prompt unique
+  bursty        --burst-size unique prompts at once every --burst-interval seconds
+
+Reports throughput, end-to-end and queue-wait percentiles, errors, memory per
+in-flight request (peak RSS growth over peak requests in flight; freed memory is not
+always returned to the OS, so this is an upper bound) and calls to each upstream, and
+writes them to --output as JSON. --baseline compares with an earlier results file.
+
+    python benchmarks/load_test.py --mix all --requests 200 --rate 20 \\
+        --generate-latency lognormal:2,0.4 --generate-error-rate 0.01 --output results.json
+"""
+import argparse
+import asyncio
+import json
+import os
+import random
+import socket
+import subprocess
+import sys
+import time
+import uuid
+
+from common import ROOT, RssSampler, examples, load_pipeline, percentile, print_results, write_json
+import fakes
+
+MIXES = ['repeat', 'multilingual', 'bursty']
+
+
+def schedule(mix, args):
+    """`(start offset in seconds, prompt, style label)` for every request of a mix."""
+    rows = examples()
+    rng = random.Random(args.seed)
+    requests = []
+    offset = 0.0
+    if mix == 'repeat':
+        hot = rows[:args.hot_prompts]
+        weights = [1.0 / (rank + 1) for rank in range(len(hot))]
+        for i in range(args.requests):
+            offset += rng.expovariate(args.rate)
+            prompt, style = rng.choices(hot, weights)[0]
+            requests.append((offset, prompt, style))
+    elif mix == 'multilingual':
+        for i in range(args.requests):
+            offset += rng.expovariate(args.rate)
+            prompt, style = rows[i % len(rows)]
+            requests.append((offset, '%s %d' % (prompt, i), style))
+    elif mix == 'bursty':
+        for i in range(args.requests):
+            prompt, style = rows[i % len(rows)]
+            requests.append((i // args.burst_size * args.burst_interval, '%s %d' % (prompt, i), style))
+    return requests
+
+
+class Stats(object):
+
+    def __init__(self):
+        self.latencies = []
+        self.queue_waits = []
+        self.errors = {}
+        self.in_flight = 0
+        self.peak_in_flight = 0
+        self.completed = 0
+
+    def error(self, message):
+        self.errors[message] = self.errors.get(message, 0) + 1
+
+
+async def submit(url, fn_index, prompt, style, stats):
+    import websockets
+    session_hash = uuid.uuid4().hex
+    stats.in_flight += 1
+    stats.peak_in_flight = max(stats.peak_in_flight, stats.in_flight)
+    start = time.perf_counter()
+    try:
+        async with websockets.connect(url, max_size=None, open_timeout=60) as websocket:
+            async for message in websocket:
+                message = json.loads(message)
+                if message['msg'] == 'send_hash':
+                    await websocket.send(json.dumps({'session_hash': session_hash, 'fn_index': fn_index}))
+                elif message['msg'] == 'send_data':
+                    await websocket.send(json.dumps({'session_hash': session_hash, 'fn_index': fn_index,
+                                                     'data': [prompt, style, False, None]}))
+                elif message['msg'] == 'process_starts':
+                    stats.queue_waits.append(time.perf_counter() - start)
+                elif message['msg'] == 'queue_full':
+                    stats.error('queue full')
+                    return
+                elif message['msg'] == 'process_completed':
+                    status = message['output'].get('data', [None, None])[1] if message['success'] else None
+                    if status == 'Success':
+                        stats.completed += 1
+                        stats.latencies.append(time.perf_counter() - start)
+                    else:
+                        # Strip the trace ID so identical failures are counted together.
+                        stats.error(str(status or message['output'].get('error')).rsplit(' [', 1)[0])
+                    return
+    except Exception as e:
+        stats.error('%s: %s' % (type(e).__name__, e))
+    finally:
+        stats.in_flight -= 1
+
+
+async def replay(url, fn_index, requests, stats):
+    async def one(offset, prompt, style):
+        await asyncio.sleep(offset)
+        await submit(url, fn_index, prompt, style, stats)
+
+    await asyncio.gather(*[one(*request) for request in requests])
+
+
+def counters(modules):
+    server = modules['server']
+    model = modules['ernie_vilg']
+    return {
+        'recognize_calls': modules['baidu_language_recognition'].calls,
+        'translate_calls': modules['baidu_translate'].calls,
+        'generate_submits': model.generate_calls,
+        'token_calls': model.token_calls,
+        'generate_http_requests': server.requests,
+        'generate_connections': server.connections,
+        'throttled': (model.throttled + server.gate.rejected + modules['baidu_translate'].throttled
+                      + modules['baidu_language_recognition'].throttled),
+        'upstream_errors': (model.failed + modules['baidu_translate'].failed
+                            + modules['baidu_language_recognition'].failed),
+    }
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+def child(args):
+    text_api = dict(latency=args.translate_latency, error_rate=args.translate_error_rate,
+                    throttle_rate=args.translate_throttle_rate, max_qps=args.translate_qps)
+    pipeline, modules = load_pipeline(
+        ernie_vilg=fakes.FakeErnieVilG(latency=args.generate_latency, image_size=(args.image_size, args.image_size),
+                                       error_rate=args.generate_error_rate,
+                                       throttle_rate=args.generate_throttle_rate),
+        translate=fakes.FakeTranslate(**text_api),
+        recognition=fakes.FakeLanguageRecognition(**text_api),
+        poll_interval=args.poll_interval)
+    modules['server'].gate.max_qps = args.generate_qps
+    import app
+    port = free_port()
+    app.launch(concurrency_count=args.concurrency_count, server_port=port, quiet=True)
+    fn_index = [i for i, dependency in enumerate(app.block.dependencies)
+                if dependency['targets'] == [app.btn._id] and dependency['trigger'] == 'click'][0]
+    url = 'ws://127.0.0.1:%d/queue/join' % port
+    # One request first, so imports and first-use setup are not counted against the mix.
+    asyncio.run(submit(url, fn_index, 'warm up', '油画(Oil painting)', Stats()))
+
+    requests = schedule(args.child, args)
+    stats = Stats()
+    before = counters(modules)
+    with RssSampler(interval=0.01) as sampler:
+        start = time.perf_counter()
+        asyncio.run(replay(url, fn_index, requests, stats))
+        elapsed = time.perf_counter() - start
+    after = counters(modules)
+    app.block.close()
+    result = {
+        'requests': len(requests),
+        'completed': stats.completed,
+        'errors': stats.errors,
+        'seconds': elapsed,
+        'throughput': stats.completed / elapsed,
+        'peak_in_flight': stats.peak_in_flight,
+        'peak_rss_growth_mib': (sampler.peak - sampler.baseline) / 2.0**20,
+        'rss_per_in_flight_kib': (sampler.peak - sampler.baseline) / 1024.0 / max(stats.peak_in_flight, 1),
+        'upstream': dict((name, after[name] - before[name]) for name in after),
+    }
+    for name, values in (('latency', stats.latencies), ('queue_wait', stats.queue_waits)):
+        for q in (50, 90, 95, 99):
+            result['%s_p%d' % (name, q)] = percentile(values, q)
+    print(json.dumps(result))
+
+
+def git_revision():
+    try:
+        return subprocess.run(['git', 'rev-parse', 'HEAD'], cwd=ROOT, capture_output=True, text=True).stdout.strip()
+    except OSError:
+        return None
+
+
+def report(mix, result, baseline):
+    rows = [
+        ('completed / requests', '%d / %d' % (result['completed'], result['requests'])),
+        ('throughput (req/s)', result['throughput']),
+        ('latency p50 (s)', result['latency_p50']),
+        ('latency p95 (s)', result['latency_p95']),
+        ('latency p99 (s)', result['latency_p99']),
+        ('queue wait p95 (s)', result['queue_wait_p95']),
+        ('peak in flight', result['peak_in_flight']),
+        ('peak RSS growth (MiB)', result['peak_rss_growth_mib']),
+        ('RSS per in-flight request (KiB)', result['rss_per_in_flight_kib']),
+    ]
+    rows.extend(('upstream %s' % name, value) for name, value in sorted(result['upstream'].items()))
+    rows.extend(('error: %s' % message[:40], count) for message, count in sorted(result['errors'].items()))
+    if baseline is not None and mix in baseline['mixes']:
+        old = baseline['mixes'][mix]
+        for name in ('throughput', 'latency_p95'):
+            if old[name]:
+                rows.append(('%s vs baseline' % name, '%+.1f%%' % ((result[name] / old[name] - 1) * 100)))
+    print_results(mix, rows)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--mix', default='all', choices=MIXES + ['all'])
+    parser.add_argument('--requests', type=int, default=200)
+    parser.add_argument('--rate', type=float, default=20.0, help='mean arrivals per second (repeat, multilingual)')
+    parser.add_argument('--hot-prompts', type=int, default=5)
+    parser.add_argument('--burst-size', type=int, default=50)
+    parser.add_argument('--burst-interval', type=float, default=5.0)
+    parser.add_argument('--concurrency-count', type=int, default=128, help='Gradio queue workers')
+    parser.add_argument('--generate-latency', default='lognormal:2,0.4', help='seconds or fakes.parse_latency() spec')
+    parser.add_argument('--generate-error-rate', type=float, default=0.0)
+    parser.add_argument('--generate-throttle-rate', type=float, default=0.0)
+    parser.add_argument('--generate-qps', type=int, default=None)
+    parser.add_argument('--translate-latency', default='lognormal:0.1,0.3')
+    parser.add_argument('--translate-error-rate', type=float, default=0.0)
+    parser.add_argument('--translate-throttle-rate', type=float, default=0.0)
+    parser.add_argument('--translate-qps', type=int, default=None)
+    parser.add_argument('--image-size', type=int, default=1024)
+    parser.add_argument('--poll-interval', type=float, default=0.5)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--output', help='write the results as JSON to this file')
+    parser.add_argument('--baseline', help='results file of an earlier run to compare with')
+    parser.add_argument('--child', choices=MIXES, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+    if args.child:
+        return child(args)
+
+    baseline = None
+    if args.baseline:
+        with open(args.baseline, encoding='utf-8') as f:
+            baseline = json.load(f)
+    config = dict((name, value) for name, value in vars(args).items() if name not in ('child', 'output', 'baseline'))
+    results = {'config': config, 'revision': git_revision(), 'time': time.time(), 'mixes': {}}
+    for mix in MIXES if args.mix == 'all' else [args.mix]:
+        command = [sys.executable, os.path.abspath(__file__)] + sys.argv[1:] + ['--child', mix]
+        output = subprocess.run(command, check=True, capture_output=True, text=True, cwd=ROOT).stdout
+        results['mixes'][mix] = json.loads(output.strip().splitlines()[-1])
+        report(mix, results['mixes'][mix], baseline)
+    if args.output:
+        write_json(args.output, results)
+
+
+if __name__ == '__main__':
+    main()
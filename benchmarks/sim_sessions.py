@@ -0,0 +1,218 @@
+"""
+Simulation of many browser sessions sharing the Gradio queue, with and without the
+per-session scheduler (session_queue.SessionQueue).
+
+Light sessions submit one prompt each at a random time. Heavy sessions click
+"Generate image" --clicks times in quick succession, and only their last click's result
+is shown. The real Gradio 3.9 queue is driven in-process: jobs are simulated by sleeping
+for --job-latency seconds, ending early if the scheduler supersedes them.
+
+Reports, per mode, how long light sessions and heavy sessions' last clicks take, how
+many jobs ran and for how many worker-seconds, the superseded/dropped counters, and
+the most jobs one session ever had running at once. Exits non-zero if a submission
+never completes, if jobs run plus jobs dropped differ from submissions, or if a
+session ran more than --max-session-jobs jobs at once under the scheduler.
+
+    python benchmarks/sim_sessions.py --light 300 --heavy 20 --clicks 8 --workers 16
+"""
+import argparse
+import asyncio
+import random
+import sys
+import time
+import types
+
+from common import percentile, print_results, write_json
+import fakes
+from session_queue import SessionQueue
+
+OUTPUTS = 3
+
+
+class FakeSocket(object):
+    """Records when a job completed; closing it looks like a disconnect."""
+
+    def __init__(self):
+        self.completed = None
+        self.closed = asyncio.Event()
+
+    async def send_json(self, data):
+        if self.closed.is_set():
+            raise RuntimeError('websocket closed')
+        if data['msg'] == 'process_completed':
+            self.completed = time.perf_counter()
+
+    async def receive(self):
+        await self.closed.wait()
+        return {'type': 'websocket.disconnect'}
+
+    async def close(self, code=1000):
+        self.closed.set()
+
+
+class Simulation(object):
+
+    def __init__(self, args, fair):
+        from gradio.queue import Queue
+        self.args = args
+        self.latency = fakes.parse_latency(args.job_latency)
+        self.queue = Queue(live_updates=False, concurrency_count=args.workers, data_gathering_start=1,
+                           update_intervals=1, max_size=None,
+                           blocks_dependencies=[{'batch': False, 'max_batch_size': 4, 'outputs': list(range(OUTPUTS))}])
+        self.queue.sleep_when_free = 0.001
+        self.queue.call_prediction = self.call_prediction
+        self.queue.reset_iterators = self.reset_iterators
+        self.scheduler = None
+        if fair:
+            self.scheduler = SessionQueue(self.queue, max_active=args.max_session_jobs, on_resubmit=self.stop)
+        self.running = {}
+        self.jobs_run = 0
+        self.worker_seconds = 0.0
+        self.peak_per_session = 0
+        self.submissions = {}
+
+    async def call_prediction(self, events, batch):
+        event = events[0]
+        stop = asyncio.Event()
+        running = self.running.setdefault(event.session_hash, [])
+        running.append(stop)
+        self.peak_per_session = max(self.peak_per_session, len(running))
+        self.jobs_run += 1
+        start = time.perf_counter()
+        try:
+            await asyncio.wait_for(stop.wait(), self.latency())
+        except asyncio.TimeoutError:
+            pass
+        finally:
+            self.worker_seconds += time.perf_counter() - start
+            running.remove(stop)
+            if not running:
+                del self.running[event.session_hash]
+        return types.SimpleNamespace(has_exception=False, status=200,
+                                     json={'data': [None] * OUTPUTS, 'is_generating': False})
+
+    async def reset_iterators(self, session_hash, fn_index):
+        pass
+
+    def stop(self, session_hash):
+        # What app.stop_session does: the handler notices at its next wake-up.
+        for stop in self.running.get(session_hash, []):
+            asyncio.get_running_loop().call_later(self.args.stop_latency, stop.set)
+
+    def submit(self, session_hash):
+        from gradio.queue import Event
+        event = Event(FakeSocket(), fn_index=0)
+        event.session_hash = session_hash
+        event.data = {'data': []}
+        event.submitted = time.perf_counter()
+        self.submissions.setdefault(session_hash, []).append(event)
+        self.queue.push(event)
+
+    async def session(self, session_hash, start, clicks):
+        await asyncio.sleep(start)
+        for click in range(clicks):
+            if click:
+                await asyncio.sleep(random.uniform(*self.args.click_interval))
+            self.submit(session_hash)
+
+    async def run(self):
+        random.seed(self.args.seed)
+        await self.queue.start()
+        sessions = [('light-%d' % i, random.uniform(0, self.args.duration), 1) for i in range(self.args.light)]
+        sessions += [('heavy-%d' % i, random.uniform(0, self.args.duration / 4.0), self.args.clicks)
+                     for i in range(self.args.heavy)]
+        await asyncio.gather(*[self.session(*session) for session in sessions])
+        deadline = time.perf_counter() + self.args.timeout
+        while self.incomplete() and time.perf_counter() < deadline:
+            await asyncio.sleep(0.01)
+        self.queue.close()
+
+    def incomplete(self):
+        return sum(event.websocket.completed is None for events in self.submissions.values() for event in events)
+
+    def results(self):
+        def last_click(prefix):
+            return [events[-1].websocket.completed - events[-1].submitted
+                    for session_hash, events in self.submissions.items()
+                    if session_hash.startswith(prefix) and events[-1].websocket.completed is not None]
+
+        light, heavy = last_click('light'), last_click('heavy')
+        return {
+            'light_p50': percentile(light, 50),
+            'light_p95': percentile(light, 95),
+            'heavy_last_click_p50': percentile(heavy, 50),
+            'heavy_last_click_p95': percentile(heavy, 95),
+            'submissions': sum(len(events) for events in self.submissions.values()),
+            'incomplete': self.incomplete(),
+            'jobs_run': self.jobs_run,
+            'worker_seconds': self.worker_seconds,
+            'superseded': self.scheduler.superseded if self.scheduler else 0,
+            'dropped': self.scheduler.dropped if self.scheduler else 0,
+            'peak_jobs_per_session': self.peak_per_session,
+        }
+
+
+def check(r, max_session_jobs):
+    """The invariants a run must hold, as messages for the ones it broke."""
+    failures = []
+    if r['incomplete']:
+        failures.append('%d submissions never completed' % r['incomplete'])
+    if r['jobs_run'] + r['dropped'] != r['submissions']:
+        failures.append('%d jobs run + %d dropped != %d submitted' % (r['jobs_run'], r['dropped'], r['submissions']))
+    if max_session_jobs is not None and r['peak_jobs_per_session'] > max_session_jobs:
+        failures.append('a session ran %d jobs at once, more than %d'
+                        % (r['peak_jobs_per_session'], max_session_jobs))
+    return failures
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--light', type=int, default=300, help='sessions that submit once')
+    parser.add_argument('--heavy', type=int, default=20, help='sessions that click repeatedly')
+    parser.add_argument('--clicks', type=int, default=8)
+    parser.add_argument('--click-interval', default='0.1,1.0',
+                        type=lambda value: [float(part) for part in value.split(',')])
+    parser.add_argument('--duration', type=float, default=10.0, help='seconds over which sessions arrive')
+    parser.add_argument('--workers', type=int, default=16, help='Gradio queue concurrency_count')
+    parser.add_argument('--job-latency', default='lognormal:1,0.4', help='seconds or fakes.parse_latency() spec')
+    parser.add_argument('--stop-latency', type=float, default=0.01, help='seconds a superseded job takes to stop')
+    parser.add_argument('--max-session-jobs', type=int, default=1,
+                        help='jobs one session may run at once; two of the same event never overlap')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--timeout', type=float, default=120.0,
+                        help='seconds to wait for outstanding submissions after the last one')
+    parser.add_argument('--json', help='also write the results to this file')
+    args = parser.parse_args()
+
+    results = {}
+    failures = []
+    for mode, fair in (('fifo', False), ('fair', True)):
+        simulation = Simulation(args, fair)
+        start = time.perf_counter()
+        asyncio.run(simulation.run())
+        results[mode] = dict(simulation.results(), seconds=time.perf_counter() - start)
+        r = results[mode]
+        print_results('%s (%s)' % (mode, 'Gradio queue only' if not fair else 'SessionQueue, max %d per session'
+                                   % args.max_session_jobs), [
+            ('light sessions p50 (s)', r['light_p50']),
+            ('light sessions p95 (s)', r['light_p95']),
+            ('heavy last click p50 (s)', r['heavy_last_click_p50']),
+            ('heavy last click p95 (s)', r['heavy_last_click_p95']),
+            ('jobs run / submitted', '%d / %d' % (r['jobs_run'], r['submissions'])),
+            ('worker seconds', r['worker_seconds']),
+            ('superseded', r['superseded']),
+            ('dropped', r['dropped']),
+            ('peak jobs per session', r['peak_jobs_per_session']),
+            ('simulation (s)', r['seconds']),
+        ])
+        failures += ['%s: %s' % (mode, failure) for failure in check(r, args.max_session_jobs if fair else None)]
+    if args.json:
+        write_json(args.json, results)
+    for failure in failures:
+        print('FAILED %s' % failure)
+    if failures:
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,100 @@
+"""
+Simulate users arriving faster than the upstream APIs allow. The fake generation API
+throttles submissions above `--generate-qps` and the fake translate/recognize modules
+above `--translate-qps`. Runs the pipeline once with a fixed budget that fails on the
+first throttle (like the original app) and once with AIMD admission control.
+
+    python benchmarks/simulate_throttling.py --users 200 --arrival-rate 8 --generate-qps 4
+"""
+import argparse
+import random
+import threading
+import time
+from collections import Counter
+
+from common import inference, load_pipeline, percentile, print_results
+from admission import AdaptiveLimiter
+import fakes
+
+
+def simulate(pipeline, server, args, seed, tag):
+    rng = random.Random(seed)
+    outcomes = Counter()
+    latencies = []
+    lock = threading.Lock()
+    throttled_before = server.gate.rejected
+
+    def user(i):
+        start = time.perf_counter()
+        try:
+            text_prompts, _ = pipeline.translate_language('A cat with glasses, %s take %d' % (tag, i))
+            inference(pipeline, text_prompts, 16, fresh=True)
+            outcome = 'ok'
+        except Exception as e:
+            outcome = type(e).__name__
+        with lock:
+            outcomes[outcome] += 1
+            if outcome == 'ok':
+                latencies.append(time.perf_counter() - start)
+
+    threads = []
+    start = time.perf_counter()
+    for i in range(args.users):
+        thread = threading.Thread(target=user, args=(i,))
+        thread.start()
+        threads.append(thread)
+        time.sleep(rng.expovariate(args.arrival_rate))
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - start
+    return [
+        ('users', args.users),
+        ('succeeded', outcomes.pop('ok', 0)),
+        ('failed', dict(outcomes)),
+        ('goodput (req/s)', args.users and (args.users - sum(outcomes.values())) / elapsed),
+        ('latency p50 (s)', percentile(latencies, 50)),
+        ('latency p95 (s)', percentile(latencies, 95)),
+        ('upstream throttled submits', server.gate.rejected - throttled_before),
+        ('final generate limit', pipeline.generation_limiter.limit),
+    ]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--users', type=int, default=200)
+    parser.add_argument('--arrival-rate', type=float, default=8.0, help='mean user arrivals per second')
+    parser.add_argument('--generate-qps', type=float, default=4.0)
+    parser.add_argument('--translate-qps', type=float, default=20.0)
+    parser.add_argument('--latency', type=float, default=1.0)
+    parser.add_argument('--jitter', type=float, default=0.5)
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+
+    model = fakes.FakeErnieVilG(latency=args.latency, jitter=args.jitter)
+    pipeline, modules = load_pipeline(
+        ernie_vilg=model,
+        translate=fakes.FakeTranslate(latency=0.02, max_qps=args.translate_qps),
+        recognition=fakes.FakeLanguageRecognition(latency=0.02, max_qps=args.translate_qps))
+    server = modules['server']
+    server.gate.max_qps = args.generate_qps
+    pipeline.THROTTLE_BACKOFF = 0.2
+
+    # The original behaviour: a large fixed budget and an error on the first throttle.
+    retries = pipeline.THROTTLE_RETRIES
+    pipeline.THROTTLE_RETRIES = 0
+    pipeline.recognition_limiter = AdaptiveLimiter('recognize', initial_limit=128, min_limit=128)
+    pipeline.translation_limiter = AdaptiveLimiter('translate', initial_limit=128, min_limit=128)
+    pipeline.generation_limiter = AdaptiveLimiter('generate', initial_limit=128, min_limit=128)
+    print_results('fixed concurrency (128)', simulate(pipeline, server, args, args.seed, 'fixed'))
+
+    pipeline.THROTTLE_RETRIES = retries
+    pipeline.recognition_limiter = AdaptiveLimiter('recognize', initial_limit=8, max_limit=64)
+    pipeline.translation_limiter = AdaptiveLimiter('translate', initial_limit=8, max_limit=64)
+    pipeline.generation_limiter = AdaptiveLimiter('generate', initial_limit=16, max_limit=128)
+    print_results('AIMD admission control', simulate(pipeline, server, args, args.seed, 'aimd'))
+    for limiter in (pipeline.recognition_limiter, pipeline.translation_limiter, pipeline.generation_limiter):
+        print_results('limiter %s' % limiter.name, sorted(limiter.stats().items()))
+
+
+if __name__ == '__main__':
+    main()
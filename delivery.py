@@ -0,0 +1,52 @@
+import io
+import threading
+
+from PIL import Image
+
+from result_cache import image_ext
+
+
+def compress(data, format='WEBP', quality=90):
+    """
+    Return already-compressed (JPEG/WebP) image bytes unchanged; encode anything else,
+    e.g. lossless PNG, once as `format` at `quality`.
+    """
+    if image_ext(data) in ('.jpg', '.webp'):
+        return data
+    image = Image.open(io.BytesIO(data)).convert('RGB')
+    buffer = io.BytesIO()
+    image.save(buffer, format=format, quality=quality)
+    return buffer.getvalue()
+
+
+class Progress(object):
+    """
+    Files of the images of one running generation as they are stored, shared by every
+    request waiting on it. Listeners are threading.Events set on each new image.
+    """
+
+    def __init__(self):
+        self.refs = 0
+        self._lock = threading.Lock()
+        self._paths = {}
+        self._listeners = set()
+
+    def add(self, index, path):
+        with self._lock:
+            self._paths[index] = path
+            listeners = list(self._listeners)
+        for event in listeners:
+            event.set()
+
+    def paths(self):
+        """Paths of the images stored so far, in generation order."""
+        with self._lock:
+            return [self._paths[index] for index in sorted(self._paths)]
+
+    def listen(self, event):
+        with self._lock:
+            self._listeners.add(event)
+
+    def unlisten(self, event):
+        with self._lock:
+            self._listeners.discard(event)
@@ -0,0 +1,185 @@
+import asyncio
+import re
+import threading
+import time
+
+import httpx
+
+from admission import UpstreamThrottled
+from token_manager import AUTH_EXPIRED_CODES, AuthExpiredError
+
+
+API_URL = 'https://wenxin.baidu.com/younger/portal/api/rest/1.0/ernievilg/v1'
+
+# Baidu AI platform code for "Open api qps request limit reached".
+THROTTLE_CODES = (18,)
+
+ERROR_MESSAGES = {
+    4001: '请求参数错误',
+    4002: '请求参数格式错误，请检查必传参数是否齐全，参数类型等',
+    4003: '请求参数中，图片风格不在可选范围内',
+    4004: 'API服务内部错误，可能引起原因有请求超时、模型推理错误等',
+}
+
+
+class ErnieVilGError(RuntimeError):
+
+    def __init__(self, message, code=None):
+        super(ErnieVilGError, self).__init__(message)
+        self.code = code
+
+
+def parse_waiting(waiting):
+    """Seconds from the `waiting` field of a getImg response such as '40s', or None."""
+    match = re.match(r'\s*(\d+(?:\.\d+)?)', str(waiting or ''))
+    return float(match.group(1)) if match else None
+
+
+def next_poll_interval(elapsed, expected, overdue_polls, min_interval, max_interval):
+    """
+    Poll rarely while the task is far from its expected completion time, halving the
+    gap as it gets closer, then every `min_interval` around that time, backing off
+    exponentially with `overdue_polls`, the polls made since the task became overdue.
+    """
+    if expected is not None and elapsed < expected:
+        interval = (expected - elapsed) / 2.0
+    else:
+        interval = min_interval * 2 ** overdue_polls
+    return max(min_interval, min(max_interval, interval))
+
+
+class ErnieVilGClient(object):
+    """
+    asyncio client for the ERNIE-ViLG submit-task / poll-result API used by the
+    ernie_vilg PaddleHub module.
+
+    All requests share one keep-alive connection pool. At most `max_concurrency`
+    generations run at once, each bounded by `timeout` seconds; cancelling the awaiting
+    task stops its polling immediately. Images are returned as the encoded bytes the
+    API serves, without decoding them; `on_image(index, data)` is also called, on the
+    loop's thread, as each one finishes downloading.
+
+    A task is polled every `min_poll_interval` seconds from its expected completion
+    time (or from submission, with no estimate) until it is `poll_grace` seconds
+    overdue, which is when it is most likely to finish; polling backs off after that.
+    """
+
+    def __init__(self, token_manager, api_url=API_URL, max_concurrency=64, max_connections=64,
+                 timeout=300.0, min_poll_interval=1.0, max_poll_interval=10.0, poll_grace=10.0):
+        self.token_manager = token_manager
+        self.api_url = api_url.rstrip('/')
+        self.max_concurrency = max_concurrency
+        self.max_connections = max_connections
+        self.timeout = timeout
+        self.min_poll_interval = min_poll_interval
+        self.max_poll_interval = max_poll_interval
+        self.poll_grace = poll_grace
+        self.submitted = 0
+        self.polls = 0
+        self._client = None
+        self._semaphore = None
+
+    def _session(self):
+        # Created on first use so that both belong to the loop the client runs on.
+        if self._client is None:
+            limits = httpx.Limits(max_connections=self.max_connections,
+                                  max_keepalive_connections=self.max_connections)
+            self._client = httpx.AsyncClient(limits=limits, timeout=httpx.Timeout(30.0))
+            self._semaphore = asyncio.Semaphore(self.max_concurrency)
+        return self._client
+
+    async def close(self):
+        if self._client is not None:
+            await self._client.aclose()
+            self._client = None
+
+    async def _request(self, endpoint, data, token):
+        response = await self._session().post('%s/%s' % (self.api_url, endpoint), params={'from': 'paddlehub'},
+                                              data=dict(data, access_token=token))
+        if response.status_code == 429:
+            raise UpstreamThrottled('Too many requests')
+        response.raise_for_status()
+        res = response.json()
+        if res['code'] in THROTTLE_CODES:
+            raise UpstreamThrottled(res.get('msg') or 'Open api qps request limit reached')
+        return res
+
+    async def _post(self, endpoint, data):
+        loop = asyncio.get_running_loop()
+        cached = self.token_manager.peek()
+        if cached is None:
+            cached = await loop.run_in_executor(None, self.token_manager.current)
+        token, generation = cached
+        res = await self._request(endpoint, data, token)
+        if res['code'] in AUTH_EXPIRED_CODES:
+            token = await loop.run_in_executor(None, self.token_manager.refresh, generation)
+            res = await self._request(endpoint, data, token)
+            if res['code'] in AUTH_EXPIRED_CODES:
+                raise AuthExpiredError('Token失效重新请求后依然发生错误，请检查输入的参数')
+        if res['code'] != 0 or res.get('msg') != 'success':
+            raise ErnieVilGError(ERROR_MESSAGES.get(res['code'], res.get('msg')), res['code'])
+        return res['data']
+
+    async def generate_image(self, text_prompts, style='油画', topk=4, timeout=None, on_image=None):
+        self._session()
+        async with self._semaphore:
+            try:
+                return await asyncio.wait_for(self._generate(text_prompts, style, topk, on_image),
+                                              self.timeout if timeout is None else timeout)
+            except asyncio.TimeoutError:
+                raise ErnieVilGError('生成超时，请稍后重试(Generation timed out, please retry later)')
+
+    async def _generate(self, text_prompts, style, topk, on_image=None):
+        task = await self._post('txt2img', {'text': text_prompts, 'style': style})
+        self.submitted += 1
+        task_id = task['taskId']
+        start = time.monotonic()
+        expected = None
+        overdue_polls = 0
+        while True:
+            data = await self._post('getImg', {'taskId': task_id})
+            self.polls += 1
+            if data['status'] == 1:
+                break
+            elapsed = time.monotonic() - start
+            waiting = parse_waiting(data.get('waiting'))
+            if waiting is not None:
+                expected = elapsed + waiting
+            interval = next_poll_interval(elapsed, expected, overdue_polls,
+                                          self.min_poll_interval, self.max_poll_interval)
+            if elapsed >= (expected or 0.0) + self.poll_grace:
+                overdue_polls += 1
+            await asyncio.sleep(interval)
+        urls = [item['image'] for item in data['imgUrls'][:topk]]
+        return await asyncio.gather(*[self._download(url, i, on_image) for i, url in enumerate(urls)])
+
+    async def _download(self, url, index=0, on_image=None):
+        response = await self._session().get(url)
+        response.raise_for_status()
+        if on_image is not None:
+            on_image(index, response.content)
+        return response.content
+
+
+class BackgroundLoop(object):
+    """
+    An asyncio event loop on a daemon thread, so synchronous Gradio handlers can hand
+    coroutines to shared async clients instead of blocking on their own connections.
+    """
+
+    def __init__(self):
+        self.loop = asyncio.new_event_loop()
+        self._thread = threading.Thread(target=self.loop.run_forever, daemon=True)
+        self._thread.start()
+
+    def submit(self, coro):
+        return asyncio.run_coroutine_threadsafe(coro, self.loop)
+
+    def run(self, coro):
+        """Wait for `coro`; if the caller goes away (e.g. its generator is closed), cancel it."""
+        future = self.submit(coro)
+        try:
+            return future.result()
+        except BaseException:
+            future.cancel()
+            raise
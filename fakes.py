@@ -0,0 +1,363 @@
+import io
+import json
+import math
+import random
+import sys
+import threading
+import time
+import types
+from collections import deque
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+from PIL import Image
+
+
+def parse_latency(spec):
+    """
+    A latency sampler from a spec: seconds ('2'), 'uniform:low,high',
+    'lognormal:median,sigma', 'exp:mean' or 'normal:mean,stddev' (clipped at 0).
+    """
+    if callable(spec):
+        return spec
+    kind, _, params = str(spec).partition(':')
+    if not params:
+        value = float(kind)
+        return lambda: value
+    values = [float(part) for part in params.split(',')]
+    if kind == 'uniform':
+        return lambda: random.uniform(values[0], values[1])
+    if kind == 'lognormal':
+        return lambda: values[0] * math.exp(random.gauss(0.0, values[1]))
+    if kind == 'exp':
+        return lambda: random.expovariate(1.0 / values[0])
+    if kind == 'normal':
+        return lambda: max(0.0, random.gauss(values[0], values[1]))
+    raise ValueError('Unknown latency distribution: %s' % spec)
+
+
+class RateGate(object):
+    """Admits at most `max_qps` calls in any one-second window; None means unlimited."""
+
+    def __init__(self, max_qps=None):
+        self.max_qps = max_qps
+        self.rejected = 0
+        self._lock = threading.Lock()
+        self._calls = deque()
+
+    def admit(self):
+        if self.max_qps is None:
+            return True
+        now = time.monotonic()
+        with self._lock:
+            while self._calls and now - self._calls[0] >= 1.0:
+                self._calls.popleft()
+            if len(self._calls) >= self.max_qps:
+                self.rejected += 1
+                return False
+            self._calls.append(now)
+            return True
+
+
+class FakeErnieVilG(object):
+    """
+    Stand-in for hub.Module(name='ernie_vilg') that never leaves the process.
+
+    `_apply_token` plays the token endpoint and counts how often it is hit. Tokens it
+    issued stay valid until `expire_tokens()` is called, after which `generate_image`
+    fails the same way the real module does when its token is rejected.
+
+    `latency` is seconds or a parse_latency() spec; `jitter` adds up to that many seconds
+    uniformly. A share `error_rate` of generations fails with an internal error and a
+    share `throttle_rate` is rejected as over the QPS limit.
+    """
+
+    def __init__(self, latency=0.0, token_latency=0.0, image_size=(64, 64), jitter=0.0,
+                 error_rate=0.0, throttle_rate=0.0):
+        self.ak = 'fake-ak'
+        self.sk = 'fake-sk'
+        self.latency = latency
+        self._latency = parse_latency(latency)
+        self.jitter = jitter
+        self.error_rate = error_rate
+        self.throttle_rate = throttle_rate
+        self.token_latency = token_latency
+        self.image_size = image_size
+        self.token_calls = 0
+        self.generate_calls = 0
+        self.throttled = 0
+        self.failed = 0
+        self._lock = threading.Lock()
+        self._valid_tokens = set()
+        self._issued = 0
+        self.token = self._apply_token(self.ak, self.sk)
+        self.token_calls = 0
+
+    def _apply_token(self, ak, sk):
+        time.sleep(self.token_latency)
+        with self._lock:
+            self.token_calls += 1
+            self._issued += 1
+            token = 'fake-token-%d' % self._issued
+            self._valid_tokens.add(token)
+        return token
+
+    def expire_tokens(self):
+        with self._lock:
+            self._valid_tokens.clear()
+
+    def is_valid_token(self, token):
+        with self._lock:
+            return token in self._valid_tokens
+
+    def sample_latency(self):
+        return self._latency() + random.uniform(0, self.jitter)
+
+    def sample_failure(self):
+        """None, or the API's (code, msg) for a generation that is throttled or fails."""
+        draw = random.random()
+        if draw < self.throttle_rate:
+            with self._lock:
+                self.throttled += 1
+            return 18, 'Open api qps request limit reached'
+        if draw < self.throttle_rate + self.error_rate:
+            with self._lock:
+                self.failed += 1
+            return 4004, 'API服务内部错误，可能引起原因有请求超时、模型推理错误等'
+        return None
+
+    def render(self, i):
+        # Gradients plus noise compress about as badly as real generated images do.
+        size = self.image_size
+        noise = Image.effect_noise(size, 32 + i * 8)
+        return Image.merge('RGB', [
+            Image.blend(Image.linear_gradient('L').resize(size), noise, 0.3),
+            Image.radial_gradient('L').resize(size),
+            noise,
+        ])
+
+    def generate_image(self, text_prompts, style='油画', topk=10, visualization=True, output_dir='ernievilg_output'):
+        with self._lock:
+            self.generate_calls += 1
+        if not self.is_valid_token(self.token):
+            raise RuntimeError("Token失效重新请求后依然发生错误，请检查输入的参数")
+        failure = self.sample_failure()
+        if failure is not None:
+            raise RuntimeError(failure[1])
+        time.sleep(self.sample_latency())
+        return [self.render(i) for i in range(topk)]
+
+
+class _HTTPServer(ThreadingHTTPServer):
+    daemon_threads = True
+    request_queue_size = 1024
+
+    def handle_error(self, request, client_address):
+        # Cancelled downloads close their connection mid-response; that is not an error here.
+        if not isinstance(sys.exc_info()[1], (BrokenPipeError, ConnectionResetError)):
+            ThreadingHTTPServer.handle_error(self, request, client_address)
+
+
+class FakeErnieVilGServer(object):
+    """
+    Local HTTP stand-in for the ERNIE-ViLG txt2img/getImg task API, backed by a
+    FakeErnieVilG for tokens, latency and call counts. Tasks finish `model.latency`
+    (plus jitter) seconds after submission; finished tasks link to JPEG images served
+    under /img/, each after `download_latency` seconds (or a parse_latency() spec).
+    Submissions above `max_qps` are throttled with code 18. Counts connections and
+    requests so clients can be compared.
+    """
+
+    def __init__(self, model, host='127.0.0.1', port=0, images_per_task=6, max_qps=None, download_latency=0.0):
+        self.model = model
+        self.images_per_task = images_per_task
+        self.download_latency = parse_latency(download_latency)
+        self.gate = RateGate(max_qps)
+        self.connections = 0
+        self.requests = 0
+        self._lock = threading.Lock()
+        self._tasks = {}
+        self._images = {}
+        self._server = _HTTPServer((host, port), self._handler())
+        self._thread = None
+
+    @property
+    def base_url(self):
+        host, port = self._server.server_address[:2]
+        return 'http://%s:%d' % (host, port)
+
+    def start(self):
+        self._thread = threading.Thread(target=self._server.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
+
+    def image_bytes(self, i):
+        with self._lock:
+            data = self._images.get(i)
+        if data is None:
+            buffer = io.BytesIO()
+            self.model.render(i).save(buffer, format='JPEG', quality=90)
+            data = buffer.getvalue()
+            with self._lock:
+                self._images[i] = data
+        return data
+
+    def submit(self, form):
+        if not self.model.is_valid_token(form.get('access_token')):
+            return {'code': 110, 'msg': 'Access token invalid or no longer valid'}
+        if not self.gate.admit():
+            return {'code': 18, 'msg': 'Open api qps request limit reached'}
+        with self.model._lock:
+            self.model.generate_calls += 1
+        failure = self.model.sample_failure()
+        if failure is not None:
+            return {'code': failure[0], 'msg': failure[1]}
+        with self._lock:
+            task_id = len(self._tasks) + 1
+            self._tasks[task_id] = (form.get('text', ''), time.monotonic() + self.model.sample_latency())
+        return {'code': 0, 'msg': 'success', 'data': {'taskId': task_id}}
+
+    def poll(self, form):
+        if not self.model.is_valid_token(form.get('access_token')):
+            return {'code': 110, 'msg': 'Access token invalid or no longer valid'}
+        task_id = int(form.get('taskId', 0))
+        with self._lock:
+            task = self._tasks.get(task_id)
+        if task is None:
+            return {'code': 4001, 'msg': '请求参数错误'}
+        text, ready_at = task
+        remaining = ready_at - time.monotonic()
+        data = {'taskId': task_id, 'text': text, 'status': 0, 'waiting': '%ds' % max(0, round(remaining)), 'imgUrls': []}
+        if remaining <= 0:
+            data['status'] = 1
+            data['imgUrls'] = [{'image': '%s/img/%d/%d.jpg' % (self.base_url, task_id, i)}
+                               for i in range(self.images_per_task)]
+        return {'code': 0, 'msg': 'success', 'data': data}
+
+    def _handler(self):
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'
+
+            def setup(self):
+                BaseHTTPRequestHandler.setup(self)
+                with server._lock:
+                    server.connections += 1
+
+            def log_message(self, format, *args):
+                pass
+
+            def _send(self, body, content_type):
+                with server._lock:
+                    server.requests += 1
+                self.send_response(200)
+                self.send_header('Content-Type', content_type)
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def do_GET(self):
+                parts = urlparse(self.path).path.strip('/').split('/')
+                if len(parts) == 3 and parts[0] == 'img':
+                    time.sleep(server.download_latency())
+                    self._send(server.image_bytes(int(parts[2].split('.')[0])), 'image/jpeg')
+                else:
+                    self.send_error(404)
+
+            def do_POST(self):
+                length = int(self.headers.get('Content-Length', 0))
+                form = {k: v[0] for k, v in parse_qs(self.rfile.read(length).decode('utf-8')).items()}
+                path = urlparse(self.path).path.rstrip('/')
+                if path.endswith('/txt2img'):
+                    result = server.submit(form)
+                elif path.endswith('/getImg'):
+                    result = server.poll(form)
+                else:
+                    self.send_error(404)
+                    return
+                self._send(json.dumps(result, ensure_ascii=False).encode('utf-8'), 'application/json')
+
+        return Handler
+
+
+class _FakeBaiduAPI(object):
+    """
+    Shared behaviour of the Baidu text API fakes: `latency` (seconds or a
+    parse_latency() spec), throttling above `max_qps` or for a share `throttle_rate` of
+    calls, and a share `error_rate` of failed calls.
+    """
+
+    def __init__(self, latency=0.0, max_qps=None, error_rate=0.0, throttle_rate=0.0):
+        self.latency = latency
+        self._latency = parse_latency(latency)
+        self.gate = RateGate(max_qps)
+        self.error_rate = error_rate
+        self.throttle_rate = throttle_rate
+        self.calls = 0
+        self.throttled = 0
+        self.failed = 0
+        self._lock = threading.Lock()
+
+    def _call(self):
+        draw = random.random()
+        throttled = not self.gate.admit() or draw < self.throttle_rate
+        failed = not throttled and draw < self.throttle_rate + self.error_rate
+        with self._lock:
+            self.calls += 1
+            self.throttled += throttled
+            self.failed += failed
+        if throttled:
+            raise RuntimeError('54003: Invalid Access Limit')
+        if failed:
+            raise RuntimeError('52002: System error')
+        time.sleep(self._latency())
+
+
+class FakeLanguageRecognition(_FakeBaiduAPI):
+    """Stand-in for hub.Module(name='baidu_language_recognition')."""
+
+    def recognize(self, query):
+        self._call()
+        if any(0x3040 <= ord(ch) <= 0x30FF for ch in query):
+            return 'jp'
+        if any(0xAC00 <= ord(ch) <= 0xD7AF for ch in query):
+            return 'kor'
+        if any(0x4E00 <= ord(ch) <= 0x9FFF for ch in query):
+            return 'zh'
+        return 'en'
+
+
+class FakeTranslate(_FakeBaiduAPI):
+    """Stand-in for hub.Module(name='baidu_translate')."""
+
+    def translate(self, query, source_language='en', target_language='zh'):
+        self._call()
+        return '(%s->%s) %s' % (source_language, target_language, query)
+
+
+def install(ernie_vilg=None, translate=None, recognition=None, load_latency=None):
+    """
+    Register a fake `paddlehub` whose `Module(name=...)` hands out the given fakes, so
+    that importing pipeline afterwards never touches PaddleHub or the Baidu services.
+    `load_latency` maps module names to the seconds `Module()` takes to return them.
+    """
+    modules = {
+        'ernie_vilg': ernie_vilg or FakeErnieVilG(),
+        'baidu_translate': translate or FakeTranslate(),
+        'baidu_language_recognition': recognition or FakeLanguageRecognition(),
+    }
+    hub = types.ModuleType('paddlehub')
+    load_latency = load_latency or {}
+
+    def module(name, **kwargs):
+        time.sleep(load_latency.get(name, 0.0))
+        return modules[name]
+
+    hub.Module = module
+    sys.modules['paddlehub'] = hub
+    return modules
@@ -0,0 +1,90 @@
+import threading
+import time
+
+
+def load_hub_module(name):
+    # paddlehub imports paddle, which alone takes seconds, so it is imported on first load too.
+    import paddlehub as hub
+    return hub.Module(name=name)
+
+
+class LazyModule(object):
+    """
+    A PaddleHub module that is loaded on first `get()`, or ahead of time by `warm()`.
+    Callers that arrive during a load wait for it; a failed load is retried by the
+    next `get()`.
+    """
+
+    def __init__(self, name, loader=load_hub_module, clock=time.perf_counter):
+        self.name = name
+        self.loader = loader
+        self.clock = clock
+        self.state = 'pending'
+        self.error = None
+        self.load_seconds = None
+        self._module = None
+        self._lock = threading.Lock()
+
+    def get(self):
+        module = self._module
+        if module is not None:
+            return module
+        with self._lock:
+            if self._module is None:
+                self.state = 'loading'
+                start = self.clock()
+                try:
+                    self._module = self.loader(self.name)
+                except Exception as e:
+                    self.state = 'failed'
+                    self.error = '%s: %s' % (type(e).__name__, e)
+                    raise
+                finally:
+                    self.load_seconds = self.clock() - start
+                self.state = 'ready'
+                self.error = None
+            return self._module
+
+    def ready(self):
+        return self._module is not None
+
+    def status(self):
+        return {'state': self.state, 'seconds': self.load_seconds, 'error': self.error}
+
+
+class HubModules(object):
+    """The PaddleHub modules the app uses, loaded lazily and warmable concurrently."""
+
+    def __init__(self, names, loader=load_hub_module):
+        self.modules = dict((name, LazyModule(name, loader)) for name in names)
+        self.started = time.perf_counter()
+
+    def get(self, name):
+        return self.modules[name].get()
+
+    def warm(self):
+        """Start loading every module not loaded yet, each on its own daemon thread."""
+        threads = []
+        for module in self.modules.values():
+            if module.state in ('pending', 'failed'):
+                thread = threading.Thread(target=self._warm, args=(module,), daemon=True)
+                thread.start()
+                threads.append(thread)
+        return threads
+
+    def _warm(self, module):
+        try:
+            module.get()
+        except Exception:
+            # Recorded in the module's status; the first request that needs it retries.
+            pass
+
+    def ready(self):
+        return all(module.ready() for module in self.modules.values())
+
+    def status(self):
+        return {
+            'ready': self.ready(),
+            'uptime': time.perf_counter() - self.started,
+            'modules': dict((name, module.status()) for name, module in self.modules.items()),
+        }
@@ -0,0 +1,235 @@
+import bisect
+import collections
+import os
+import sys
+import threading
+import time
+import uuid
+
+
+# Upper bounds in seconds; generation takes tens of seconds, translation tens of milliseconds.
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 20.0, 30.0, 60.0, 120.0, 300.0)
+
+
+def new_trace_id():
+    return uuid.uuid4().hex[:16]
+
+
+def _labels(labels):
+    return tuple(sorted(labels.items()))
+
+
+def _format_labels(labels, extra=()):
+    pairs = list(labels) + list(extra)
+    if not pairs:
+        return ''
+    return '{%s}' % ','.join('%s="%s"' % (name, str(value).replace('\\', '\\\\').replace('"', '\\"'))
+                             for name, value in pairs)
+
+
+class Metrics(object):
+    """
+    In-process counters, gauges and latency histograms, rendered in the Prometheus text
+    format. Each update is a dict lookup and a few additions under one lock, so it can
+    wrap every upstream call. `enabled = False` turns `timed()` into a no-op.
+
+    The last `max_spans` timed calls that carried a trace ID are kept, so all stages of
+    one request can be looked up with `trace(trace_id)`.
+    """
+
+    def __init__(self, prefix='ernievilg', buckets=LATENCY_BUCKETS, max_spans=4096):
+        self.prefix = prefix
+        self.buckets = buckets
+        self.enabled = True
+        self._lock = threading.Lock()
+        self._counters = {}
+        self._gauges = {}
+        self._histograms = {}
+        self._help = {}
+        self._collectors = []
+        self._spans = collections.deque(maxlen=max_spans)
+
+    def describe(self, name, text):
+        self._help[name] = text
+
+    def inc(self, name, value=1, **labels):
+        key = (name, _labels(labels))
+        with self._lock:
+            self._counters[key] = self._counters.get(key, 0) + value
+
+    def add(self, name, delta, **labels):
+        key = (name, _labels(labels))
+        with self._lock:
+            self._gauges[key] = self._gauges.get(key, 0) + delta
+
+    def observe(self, name, value, **labels):
+        with self._lock:
+            self._observe((name, _labels(labels)), value)
+
+    def _observe(self, key, value):
+        histogram = self._histograms.get(key)
+        if histogram is None:
+            # One count per bucket plus +Inf, then the sum.
+            histogram = self._histograms[key] = [0] * (len(self.buckets) + 1) + [0.0]
+        histogram[bisect.bisect_left(self.buckets, value)] += 1
+        histogram[-1] += value
+
+    def error(self, stage, e, style=''):
+        self.inc('errors_total', stage=stage, exception=type(e).__name__, style=style)
+
+    def timed(self, stage, style='', trace_id=None):
+        """
+        Context manager timing its block as `stage`: latency histogram, in-flight gauge,
+        errors by exception class and style, and a span when `trace_id` is given.
+        """
+        if not self.enabled:
+            return _NOT_TIMED
+        return _Timer(self, stage, style, trace_id)
+
+    def trace(self, trace_id):
+        return [{'stage': stage, 'start': start, 'seconds': seconds, 'error': outcome}
+                for span_id, stage, start, seconds, outcome in list(self._spans) if span_id == trace_id]
+
+    def register(self, collector):
+        """`collector()` returns `(name, kind, labels, value)` tuples, read at render time."""
+        self._collectors.append(collector)
+
+    def render(self):
+        with self._lock:
+            counters = sorted(self._counters.items())
+            gauges = sorted(self._gauges.items())
+            histograms = sorted((key, list(value)) for key, value in self._histograms.items())
+        samples = collections.OrderedDict()
+        for (name, labels), value in counters:
+            samples.setdefault((name, 'counter'), []).append((name, labels, (), value))
+        for (name, labels), value in gauges:
+            samples.setdefault((name, 'gauge'), []).append((name, labels, (), value))
+        for (name, labels), histogram in histograms:
+            cumulative = 0
+            series = samples.setdefault((name, 'histogram'), [])
+            for bound, count in zip(list(self.buckets) + ['+Inf'], histogram[:-1]):
+                cumulative += count
+                series.append((name + '_bucket', labels, (('le', bound),), cumulative))
+            series.append((name + '_sum', labels, (), histogram[-1]))
+            series.append((name + '_count', labels, (), cumulative))
+        for collector in self._collectors:
+            for name, kind, labels, value in collector():
+                samples.setdefault((name, kind), []).append((name, _labels(labels), (), value))
+        lines = []
+        for (name, kind), series in samples.items():
+            if name in self._help:
+                lines.append('# HELP %s_%s %s' % (self.prefix, name, self._help[name]))
+            lines.append('# TYPE %s_%s %s' % (self.prefix, name, kind))
+            for sample, labels, extra, value in series:
+                lines.append('%s_%s%s %s' % (self.prefix, sample, _format_labels(labels, extra), value))
+        return '\n'.join(lines) + '\n'
+
+    def instrument_queue(self, queue):
+        """
+        Record how long events wait in a Gradio queue before a worker picks them up.
+        Gradio 3.9 has no hook for this, so the queue's own push/process_events are wrapped.
+        """
+        push = queue.push
+        process_events = queue.process_events
+
+        def timed_push(event):
+            event.enqueued_at = time.perf_counter()
+            return push(event)
+
+        async def timed_process_events(events, batch):
+            now = time.perf_counter()
+            for event in events:
+                if getattr(event, 'enqueued_at', None) is not None:
+                    self.observe('queue_wait_seconds', now - event.enqueued_at)
+            return await process_events(events, batch)
+
+        queue.push = timed_push
+        queue.process_events = timed_process_events
+        self.register(lambda: [
+            ('queue_size', 'gauge', {}, len(queue.event_queue)),
+            ('queue_active_workers', 'gauge', {}, queue.get_active_worker_count()),
+        ])
+
+
+class _Timer(object):
+    __slots__ = ('metrics', 'stage', 'style', 'trace_id', 'key', 'start')
+
+    def __init__(self, metrics, stage, style, trace_id):
+        self.metrics = metrics
+        self.stage = stage
+        self.style = style
+        self.trace_id = trace_id
+        self.key = (('stage', stage),)
+
+    def __enter__(self):
+        metrics = self.metrics
+        key = ('in_flight', self.key)
+        with metrics._lock:
+            metrics._gauges[key] = metrics._gauges.get(key, 0) + 1
+        self.start = time.perf_counter()
+
+    def __exit__(self, kind, e, tb):
+        seconds = time.perf_counter() - self.start
+        metrics = self.metrics
+        key = ('in_flight', self.key)
+        with metrics._lock:
+            metrics._gauges[key] -= 1
+            metrics._observe(('stage_seconds', self.key), seconds)
+        if kind is not None and issubclass(kind, Exception):
+            metrics.error(self.stage, e, self.style)
+        if self.trace_id is not None:
+            outcome = None if kind is None else kind.__name__
+            metrics._spans.append((self.trace_id, self.stage, time.time() - seconds, seconds, outcome))
+        return False
+
+
+class _NotTimed(object):
+
+    def __enter__(self):
+        pass
+
+    def __exit__(self, *exc):
+        return False
+
+
+_NOT_TIMED = _NotTimed()
+
+
+class SamplingProfiler(object):
+    """
+    Samples the stacks of all threads every `interval` seconds and counts them in the
+    collapsed format flamegraph tools read ("frame;frame;frame count").
+    """
+
+    def __init__(self, interval=0.01, max_depth=64):
+        self.interval = interval
+        self.max_depth = max_depth
+        self.samples = collections.Counter()
+        self._stop = threading.Event()
+        self._thread = None
+
+    def start(self):
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._stop.set()
+        self._thread.join()
+        return self
+
+    def _run(self):
+        own = threading.get_ident()
+        while not self._stop.wait(self.interval):
+            for thread_id, frame in sys._current_frames().items():
+                if thread_id == own:
+                    continue
+                stack = []
+                while frame is not None and len(stack) < self.max_depth:
+                    stack.append('%s:%s' % (os.path.basename(frame.f_code.co_filename), frame.f_code.co_name))
+                    frame = frame.f_back
+                self.samples[';'.join(reversed(stack))] += 1
+
+    def collapsed(self):
+        return '\n'.join('%s %d' % (stack, count) for stack, count in self.samples.most_common()) + '\n'
@@ -0,0 +1,236 @@
+import asyncio
+import concurrent.futures
+import os
+import threading
+import time
+import uuid
+
+from admission import OVERLOADED_MESSAGE, AdaptiveLimiter, Overloaded, UpstreamThrottled, is_throttle_error
+from delivery import Progress, compress
+from ernie_client import API_URL, BackgroundLoop, ErnieVilGClient
+from hub_modules import HubModules
+from metrics import Metrics
+from result_cache import ResultCache, make_key
+from single_flight import SingleFlight
+from token_manager import TokenManager
+from translation_cache import TranslationCache
+
+
+# Loaded on first use; app.py warms them in the background while the UI starts.
+modules = HubModules(['ernie_vilg', 'baidu_translate', 'baidu_language_recognition'])
+metrics = Metrics()
+token_manager = TokenManager(lambda: model(), apply_token=lambda module: _apply_token(module))
+result_cache = ResultCache('ernievilg_cache')
+# Kept outside the working directory: Gradio serves any file under it, and only the
+# image directories the gallery references belong there.
+data_dir = os.environ.get('ERNIEVILG_DATA_DIR') or os.path.join(
+    os.environ.get('XDG_CACHE_HOME') or os.path.expanduser('~/.cache'), 'ernievilg')
+translation_cache = TranslationCache(os.path.join(data_dir, 'translations.db'))
+background_loop = BackgroundLoop()
+client = ErnieVilGClient(token_manager, api_url=os.environ.get('ERNIE_VILG_API_URL', API_URL), max_concurrency=128)
+generations = SingleFlight(max_waiters=32)
+# Progress of each running generation by key, kept while any request is waiting on it.
+_progress = {}
+_progress_lock = threading.Lock()
+# Separate admission budgets per upstream API, adjusted by AIMD from observed latency and throttling.
+recognition_limiter = AdaptiveLimiter('recognize', initial_limit=8, max_limit=64)
+translation_limiter = AdaptiveLimiter('translate', initial_limit=8, max_limit=64)
+generation_limiter = AdaptiveLimiter('generate', initial_limit=16, max_limit=128)
+
+# Images the API returns already compressed are kept byte for byte; anything lossless
+# is encoded once in this format before it is cached and served.
+IMAGE_FORMAT = 'WEBP'
+IMAGE_QUALITY = 90
+
+# How often a throttled upstream call is retried, and the first backoff in seconds.
+THROTTLE_RETRIES = 3
+THROTTLE_BACKOFF = 1.0
+
+style_list = ['古风', '油画', '水彩', '卡通', '二次元', '浮世绘', '蒸汽波艺术', 'low poly', '像素风格', '概念艺术', '未来主义', '赛博朋克', '写实风格', '洛丽塔风格', '巴洛克风格', '超现实主义', '探索无限']
+
+
+def model():
+    return modules.get('ernie_vilg')
+
+
+def language_translation_model():
+    return modules.get('baidu_translate')
+
+
+def language_recognition_model():
+    return modules.get('baidu_language_recognition')
+
+
+def translate_language(text_prompts, trace_id=None):
+    """Return the prompt in Chinese together with the detected language code."""
+    return translation_cache.translate(
+        text_prompts,
+        _limited(recognition_limiter, lambda *args: language_recognition_model().recognize(*args), trace_id),
+        _limited(translation_limiter, lambda *args: language_translation_model().translate(*args), trace_id))
+
+
+def _apply_token(module):
+    with metrics.timed('apply_token'):
+        return module._apply_token(module.ak, module.sk)
+
+
+def _limited(limiter, fn, trace_id=None):
+    def call(*args):
+        for attempt in range(THROTTLE_RETRIES + 1):
+            try:
+                with limiter.slot(), metrics.timed(limiter.name, trace_id=trace_id):
+                    return fn(*args)
+            except Exception as e:
+                if not is_throttle_error(e):
+                    raise
+                if attempt == THROTTLE_RETRIES:
+                    raise Overloaded(OVERLOADED_MESSAGE) from e
+            time.sleep(THROTTLE_BACKOFF * 2 ** attempt)
+    return call
+
+
+def submit_inference(text_prompts, style_indx, fresh=False, topk=4, trace_id=None):
+    """
+    Start generating `topk` images for a Chinese prompt and return a future of their
+    encoded bytes. Cached results are reused unless `fresh`, and identical requests that
+    arrive while a generation is running share it (its spans carry the first caller's
+    `trace_id`). Cancelling the future detaches this caller; the upstream task stops once
+    no caller is left.
+
+    While the generation runs, `future.progress` collects the files of the images that
+    have finished downloading; it is None when the result came from the cache.
+    """
+    style = style_list[style_indx]
+    key = make_key(text_prompts, style, topk)
+    images = None if fresh else result_cache.get(key)
+    if images is not None:
+        future = concurrent.futures.Future()
+        future.set_result(images)
+        future.progress = None
+    else:
+        # Attached before the generation starts, so it finds the progress to report to.
+        progress = _attach_progress(key)
+        future = background_loop.submit(generations.do(key, _generate, key, text_prompts, style, topk, trace_id))
+        future.progress = progress
+        future.add_done_callback(lambda future: _detach_progress(key))
+    future.key = key
+    return future
+
+
+def _attach_progress(key):
+    with _progress_lock:
+        progress = _progress.get(key)
+        if progress is None:
+            progress = _progress[key] = Progress()
+        progress.refs += 1
+    return progress
+
+
+def _detach_progress(key):
+    with _progress_lock:
+        progress = _progress[key]
+        progress.refs -= 1
+        if progress.refs == 0:
+            del _progress[key]
+
+
+def publish(key, images):
+    """
+    Paths of the cached files for `images`, for the gallery to serve as they are
+    instead of re-encoding decoded images. Rewrites the entry if it was evicted.
+    """
+    paths = result_cache.paths(key)
+    if paths is None or len(paths) != len(images):
+        result_cache.put(key, images)
+        paths = result_cache.paths(key)
+    return paths
+
+
+def queue_position(future):
+    """Position of a submit_inference() request in the generation admission queue, or None."""
+    return generation_limiter.position(getattr(future, 'key', None))
+
+
+async def _generate(key, text_prompts, style, topk, trace_id=None):
+    loop = asyncio.get_running_loop()
+    progress = _progress.get(key)
+    # Each image is encoded and written once, as it lands; that file is both streamed
+    # to the gallery and, once every image is in, adopted as the cache entry.
+    version = uuid.uuid4().hex[:12]
+    stored = {}
+    written = []
+
+    def store(index, data):
+        data = compress(data, IMAGE_FORMAT, IMAGE_QUALITY)
+        path = result_cache.write(key, version, index, data)
+        written.append(path)
+        if progress is not None:
+            progress.add(index, path)
+        return data, path
+
+    def on_image(index, data):
+        stored[index] = loop.run_in_executor(None, store, index, data)
+
+    try:
+        images = await _download(key, text_prompts, style, topk, trace_id, on_image)
+        results = await asyncio.gather(*[stored[i] for i in range(len(images))])
+    except BaseException:
+        # Never put(), so these files must not outlive the generation.
+        if stored:
+            await asyncio.wait(list(stored.values()))
+        result_cache.discard(written)
+        raise
+    images = [data for data, _ in results]
+    await loop.run_in_executor(None, result_cache.put, key, images, [path for _, path in results])
+    return images
+
+
+async def _download(key, text_prompts, style, topk, trace_id, on_image):
+    for attempt in range(THROTTLE_RETRIES + 1):
+        ticket = await generation_limiter.acquire_async(key)
+        outcome = 'error'
+        try:
+            with metrics.timed('generate', style, trace_id):
+                images = await client.generate_image(text_prompts, style, topk, on_image=on_image)
+            outcome = 'ok'
+            break
+        except UpstreamThrottled as e:
+            outcome = 'throttled'
+            if attempt == THROTTLE_RETRIES:
+                raise Overloaded(OVERLOADED_MESSAGE) from e
+        except asyncio.CancelledError:
+            outcome = 'cancelled'
+            raise
+        finally:
+            generation_limiter.release(ticket, outcome)
+        await asyncio.sleep(THROTTLE_BACKOFF * 2 ** attempt)
+    return images
+
+
+def _collect():
+    for limiter in (recognition_limiter, translation_limiter, generation_limiter):
+        stats = limiter.stats()
+        yield 'admission_limit', 'gauge', {'api': limiter.name}, stats['limit']
+        yield 'admission_queued', 'gauge', {'api': limiter.name}, stats['queued']
+        for outcome in ('successes', 'errors', 'throttles', 'shed'):
+            yield 'admission_calls_total', 'counter', {'api': limiter.name, 'outcome': outcome}, stats[outcome]
+    stats = result_cache.stats()
+    for outcome in ('memory_hits', 'disk_hits', 'misses'):
+        yield 'result_cache_lookups_total', 'counter', {'outcome': outcome}, stats[outcome]
+    yield 'result_cache_bytes', 'gauge', {'tier': 'memory'}, stats['memory_bytes']
+    yield 'result_cache_bytes', 'gauge', {'tier': 'disk'}, stats['disk_bytes']
+    yield 'translation_cache_lookups_total', 'counter', {'outcome': 'hit'}, translation_cache.hits
+    yield 'translation_cache_lookups_total', 'counter', {'outcome': 'miss'}, translation_cache.misses
+    yield 'generations_shared_total', 'counter', {}, generations.shared
+    yield 'generations_overflowed_total', 'counter', {}, generations.overflowed
+    yield 'upstream_polls_total', 'counter', {}, client.polls
+    yield 'token_refreshes_total', 'counter', {}, token_manager.refresh_count
+    for name, status in modules.status()['modules'].items():
+        yield 'module_ready', 'gauge', {'module': name}, int(status['state'] == 'ready')
+
+
+metrics.register(_collect)
+metrics.describe('stage_seconds', 'Latency of each pipeline stage and upstream call.')
+metrics.describe('in_flight', 'Calls currently running per stage.')
+metrics.describe('errors_total', 'Failed calls by stage, exception class and style.')
+metrics.describe('queue_wait_seconds', 'Time requests wait in the Gradio queue for a worker.')
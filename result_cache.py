@@ -0,0 +1,222 @@
+import hashlib
+import io
+import json
+import os
+import threading
+import time
+import unicodedata
+from collections import OrderedDict
+
+from PIL import Image
+
+
+def normalize_prompt(text):
+    return ' '.join(unicodedata.normalize('NFKC', text).split())
+
+
+def make_key(text_prompts, style, topk):
+    payload = json.dumps([normalize_prompt(text_prompts), style, topk], ensure_ascii=False)
+    return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+
+def image_ext(data):
+    if data[:8] == b'\x89PNG\r\n\x1a\n':
+        return '.png'
+    if data[:3] == b'\xff\xd8\xff':
+        return '.jpg'
+    if data[:4] == b'RIFF' and data[8:12] == b'WEBP':
+        return '.webp'
+    return '.img'
+
+
+def decode_image(data):
+    image = Image.open(io.BytesIO(data))
+    image.load()
+    return image
+
+
+class ResultCache(object):
+    """
+    Two-tier cache of generated images, keyed by `make_key(prompt, style, topk)`.
+
+    Entries are lists of encoded images. The memory tier is an LRU bounded by
+    `memory_bytes`; every entry is also written to `cache_dir`, which is trimmed to
+    `disk_bytes` (oldest first). Entries older than `max_age` seconds are misses in
+    either tier.
+
+    Files are named `<key>_<index>_<version>.<ext>`, so a regenerated entry gets new
+    URLs and a browser never shows its copy of the images it replaced. `put()` uses a
+    hash of the images as the version; an entry stored as its images arrive writes them
+    with `write()` under a version of its own and then passes their paths to `put()`.
+    """
+
+    def __init__(self, cache_dir, memory_bytes=64 * 2**20, disk_bytes=2 * 2**30, max_age=7 * 24 * 3600):
+        self.cache_dir = cache_dir
+        self.memory_bytes = memory_bytes
+        self.disk_bytes = disk_bytes
+        self.max_age = max_age
+        self.hits = 0
+        self.memory_hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._lock = threading.Lock()
+        # key -> (images, mtime), least recently used first.
+        self._memory = OrderedDict()
+        self._memory_size = 0
+        # key -> (paths, size, mtime), ordered oldest first.
+        self._disk = OrderedDict()
+        self._disk_size = 0
+        os.makedirs(cache_dir, exist_ok=True)
+        self._load_index()
+
+    def _load_index(self):
+        versions = {}
+        for name in os.listdir(self.cache_dir):
+            path = os.path.join(self.cache_dir, name)
+            if name.endswith('.tmp'):
+                # Left behind by a write that was interrupted.
+                os.remove(path)
+                continue
+            parts = name.split('.')[0].split('_')
+            if len(parts) < 2 or not parts[1].isdigit():
+                continue
+            key, index, version = parts[0], int(parts[1]), '_'.join(parts[2:])
+            stat = os.stat(path)
+            paths, size, mtime = versions.get((key, version), ([], 0, 0.0))
+            versions[(key, version)] = (paths + [(index, path)], size + stat.st_size, max(mtime, stat.st_mtime))
+        entries = {}
+        for (key, _), entry in sorted(versions.items(), key=lambda item: item[1][2]):
+            if key in entries:
+                # A version replaced by a newer one whose old files were not removed.
+                for _, path in entries[key][0]:
+                    os.remove(path)
+            entries[key] = entry
+        for key, (paths, size, mtime) in sorted(entries.items(), key=lambda item: item[1][2]):
+            self._disk[key] = ([path for _, path in sorted(paths)], size, mtime)
+            self._disk_size += size
+        with self._lock:
+            self._evict_disk()
+
+    def stats(self):
+        with self._lock:
+            return {
+                'hits': self.hits,
+                'memory_hits': self.memory_hits,
+                'disk_hits': self.disk_hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+                'memory_entries': len(self._memory),
+                'memory_bytes': self._memory_size,
+                'disk_entries': len(self._disk),
+                'disk_bytes': self._disk_size,
+            }
+
+    def get(self, key):
+        with self._lock:
+            cached = self._memory.get(key)
+            if cached is not None:
+                if time.time() - cached[1] <= self.max_age:
+                    self._memory.move_to_end(key)
+                    self.hits += 1
+                    self.memory_hits += 1
+                    return cached[0]
+                self._drop_memory(key)
+            entry = self._disk.get(key)
+            if entry is None or time.time() - entry[2] > self.max_age:
+                self.misses += 1
+                return None
+        try:
+            images = []
+            for path in entry[0]:
+                with open(path, 'rb') as f:
+                    images.append(f.read())
+        except OSError:
+            with self._lock:
+                if key in self._disk:
+                    self._drop_disk(key)
+                self.misses += 1
+            return None
+        with self._lock:
+            self.hits += 1
+            self.disk_hits += 1
+            self._put_memory(key, images, entry[2])
+        return images
+
+    def write(self, key, version, index, data):
+        """Write one image file of a `version` of an entry, not yet part of the cache."""
+        path = os.path.join(self.cache_dir, '%s_%d_%s%s' % (key, index, version, image_ext(data)))
+        # Written under a temporary name so a concurrent reader never serves half a file.
+        tmp_path = '%s.%d.tmp' % (path, threading.get_ident())
+        with open(tmp_path, 'wb') as f:
+            f.write(data)
+        os.replace(tmp_path, path)
+        return path
+
+    def discard(self, paths):
+        """Remove files written with write() for an entry that was never put()."""
+        for path in paths:
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+
+    def put(self, key, images, paths=None):
+        """Store `images`; `paths` are their files if they were already written with write()."""
+        if paths is None:
+            version = hashlib.sha1(b''.join(images)).hexdigest()[:12]
+            paths = [self.write(key, version, i, data) for i, data in enumerate(images)]
+        size = sum(len(data) for data in images)
+        mtime = time.time()
+        with self._lock:
+            self._put_memory(key, images, mtime)
+            stale = []
+            if key in self._disk:
+                old_paths, old_size, _ = self._disk.pop(key)
+                self._disk_size -= old_size
+                stale = [path for path in old_paths if path not in paths]
+            self._disk[key] = (paths, size, mtime)
+            self._disk_size += size
+            self._evict_disk()
+        self.discard(stale)
+
+    def paths(self, key):
+        """Paths of the files of a disk entry, or None if it is not on disk."""
+        with self._lock:
+            entry = self._disk.get(key)
+            return list(entry[0]) if entry is not None else None
+
+    def _put_memory(self, key, images, mtime):
+        self._drop_memory(key)
+        size = sum(len(data) for data in images)
+        if size > self.memory_bytes:
+            return
+        self._memory[key] = (images, mtime)
+        self._memory_size += size
+        while self._memory_size > self.memory_bytes:
+            _, (evicted, _) = self._memory.popitem(last=False)
+            self._memory_size -= sum(len(data) for data in evicted)
+            self.evictions += 1
+
+    def _drop_memory(self, key):
+        if key in self._memory:
+            self._memory_size -= sum(len(data) for data in self._memory.pop(key)[0])
+
+    def _drop_disk(self, key):
+        paths, size, _ = self._disk.pop(key)
+        self._disk_size -= size
+        for path in paths:
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+
+    def _evict_disk(self):
+        now = time.time()
+        while self._disk:
+            key, (_, _, mtime) = next(iter(self._disk.items()))
+            if self._disk_size <= self.disk_bytes and now - mtime <= self.max_age:
+                break
+            self._drop_disk(key)
+            self._drop_memory(key)
+            self.evictions += 1
@@ -0,0 +1,188 @@
+import asyncio
+
+
+class SessionQueue(object):
+    """
+    A per-session fair scheduler in front of a Gradio 3.9 queue, which on its own runs
+    jobs first come first served with no notion of who submitted them.
+
+    - Each browser session runs at most `max_active` jobs at once, and never two of the
+      same event: Gradio keeps one running generator per session and event, so a second
+      one would step the first one's generator. Further jobs are held back and queued
+      as the session's running ones finish.
+    - With `supersede`, a new submission replaces the session's older ones: jobs still
+      waiting are dropped (their clients get an empty completion), and
+      `on_resubmit(session_hash)` is called so running ones can stop early.
+    - Workers take queued jobs round-robin by session: the job of the session with the
+      fewest running jobs first, then the one submitted earliest, so one session with
+      many jobs does not delay everyone who submitted after it. A replacement lines up
+      from when it was submitted.
+    - `on_disconnect(session_hash)` is called when a client closes its websocket before
+      its job has completed; Gradio itself keeps stepping a generator whose client is
+      gone.
+    """
+
+    def __init__(self, queue, max_active=1, supersede=True, on_resubmit=None, on_disconnect=None):
+        self.queue = queue
+        self.max_active = max_active
+        self.supersede = supersede
+        self.on_resubmit = on_resubmit
+        self.on_disconnect = on_disconnect
+        self.superseded = 0
+        self.dropped = 0
+        # Per session: the running events, fn_index of each job in the Gradio queue,
+        # and the events held back until the session has room.
+        self._active = {}
+        self._queued = {}
+        self._held = {}
+        self._submitted = 0
+        self._push = queue.push
+        self._process_events = queue.process_events
+        self._gather_event_data = queue.gather_event_data
+        self._send_message = queue.send_message
+        self._clean_event = queue.clean_event
+        queue.push = self.push
+        queue.get_events_in_batch = self.get_events_in_batch
+        queue.process_events = self.process_events
+        queue.gather_event_data = self.gather_event_data
+        queue.send_message = self.send_message
+        queue.clean_event = self.clean_event
+
+    def held(self):
+        return sum(len(events) for events in self._held.values())
+
+    def active(self):
+        return sum(len(jobs) for jobs in self._active.values())
+
+    def collect(self):
+        """Metrics.register() collector."""
+        yield 'session_jobs_superseded_total', 'counter', {}, self.superseded
+        yield 'session_jobs_dropped_total', 'counter', {}, self.dropped
+        yield 'session_jobs_held', 'gauge', {}, self.held()
+        yield 'sessions_active', 'gauge', {}, len(self._active)
+
+    def _has_room(self, session_hash, fn_index):
+        active = self._active.get(session_hash, [])
+        queued = self._queued.get(session_hash, [])
+        return (len(active) + len(queued) < self.max_active
+                and all(event.fn_index != fn_index for event in active) and fn_index not in queued)
+
+    def push(self, event):
+        session_hash = event.session_hash
+        event.session_order = self._submitted
+        self._submitted += 1
+        if self.supersede:
+            self._supersede(session_hash)
+        if self._has_room(session_hash, event.fn_index):
+            rank = self._push(event)
+            if rank is not None:
+                self._enqueued(event)
+            return rank
+        self._held.setdefault(session_hash, []).append(event)
+        return len(self.queue.event_queue)
+
+    def _enqueued(self, event):
+        event.session_queued = True
+        self._queued.setdefault(event.session_hash, []).append(event.fn_index)
+
+    def _dequeued(self, event):
+        event.session_queued = False
+        queued = self._queued[event.session_hash]
+        queued.remove(event.fn_index)
+        if not queued:
+            del self._queued[event.session_hash]
+
+    def _supersede(self, session_hash):
+        waiting = [event for event in self.queue.event_queue if event.session_hash == session_hash]
+        for event in waiting:
+            self.queue.event_queue.remove(event)
+            self._dequeued(event)
+        waiting.extend(self._held.pop(session_hash, []))
+        for event in waiting:
+            self.dropped += 1
+            asyncio.ensure_future(self._drop(event))
+        # A running job is told to stop once; further clicks while it winds down do not
+        # count it again.
+        running = [event for event in self._active.get(session_hash, ())
+                   if not getattr(event, 'session_superseded', False)]
+        for event in running:
+            event.session_superseded = True
+        if running:
+            self.superseded += len(running)
+            if self.on_resubmit is not None:
+                self.on_resubmit(session_hash)
+
+    async def _drop(self, event):
+        # Outputs left as they are, so the newer job's updates are not overwritten.
+        outputs = self.queue.blocks_dependencies[event.fn_index]['outputs']
+        await self._send_message(event, {'msg': 'process_completed', 'success': True,
+                                         'output': {'data': [{'__type__': 'update'}] * len(outputs)}})
+        try:
+            await event.disconnect()
+        except Exception:
+            pass
+
+    def get_events_in_batch(self):
+        if not self.queue.event_queue:
+            return None, False
+        event = min(self.queue.event_queue,
+                    key=lambda event: (len(self._active.get(event.session_hash, ())), event.session_order))
+        self.queue.event_queue.remove(event)
+        self._dequeued(event)
+        session_hash = event.session_hash
+        self._active.setdefault(session_hash, []).append(event)
+        event.session_active = True
+        return [event], self.queue.blocks_dependencies[event.fn_index]['batch']
+
+    def _promote(self, session_hash):
+        held = self._held.get(session_hash)
+        while held and self._has_room(session_hash, held[0].fn_index):
+            event = held.pop(0)
+            if self._push(event) is None:
+                held.insert(0, event)
+                break
+            self._enqueued(event)
+        if not held:
+            self._held.pop(session_hash, None)
+
+    async def process_events(self, events, batch):
+        try:
+            return await self._process_events(events, batch)
+        finally:
+            for event in events:
+                if getattr(event, 'session_active', False):
+                    event.session_active = False
+                    active = self._active[event.session_hash]
+                    active.remove(event)
+                    if not active:
+                        del self._active[event.session_hash]
+                    self._promote(event.session_hash)
+
+    async def clean_event(self, event):
+        # Called when a queued client stops answering; its place must not stay taken.
+        await self._clean_event(event)
+        if getattr(event, 'session_queued', False) and event not in self.queue.event_queue:
+            self._dequeued(event)
+            self._promote(event.session_hash)
+
+    async def gather_event_data(self, event):
+        gathered = await self._gather_event_data(event)
+        if gathered and self.on_disconnect is not None and getattr(event, 'watcher', None) is None:
+            # Gradio reads nothing more from the socket once it has the data, so it is
+            # safe to wait here for the client to go away.
+            event.watcher = asyncio.ensure_future(self._watch(event))
+        return gathered
+
+    async def _watch(self, event):
+        try:
+            while (await event.websocket.receive())['type'] != 'websocket.disconnect':
+                pass
+        except Exception:
+            pass
+        if not getattr(event, 'completed', False):
+            self.on_disconnect(event.session_hash)
+
+    async def send_message(self, event, data):
+        if data.get('msg') == 'process_completed':
+            event.completed = True
+        return await self._send_message(event, data)
@@ -0,0 +1,65 @@
+import asyncio
+
+
+class _Call(object):
+
+    def __init__(self, task):
+        self.task = task
+        self.waiters = 0
+
+
+class SingleFlight(object):
+    """
+    Coalesces concurrent calls that share a key: the first caller starts the coroutine,
+    later callers attach to it and get the same result or exception.
+
+    The shared task is only cancelled once every caller attached to it has been
+    cancelled, so one user leaving does not fail the others. At most `max_waiters`
+    callers attach to one call; further ones wait for its result without keeping it
+    alive, and if their attached callers all leave they attach again or start it anew.
+    """
+
+    def __init__(self, max_waiters=32):
+        self.max_waiters = max_waiters
+        self.calls = 0
+        self.shared = 0
+        self.overflowed = 0
+        self._calls = {}
+
+    def waiters(self, key):
+        call = self._calls.get(key)
+        return call.waiters if call is not None else 0
+
+    def in_flight(self):
+        return len(self._calls)
+
+    async def do(self, key, fn, *args, **kwargs):
+        call = self._calls.get(key)
+        if call is not None and call.waiters >= self.max_waiters:
+            self.overflowed += 1
+            while call is not None and call.waiters >= self.max_waiters:
+                try:
+                    return await asyncio.shield(call.task)
+                except asyncio.CancelledError:
+                    if not call.task.cancelled():
+                        # This caller was cancelled, not the call it was waiting for.
+                        raise
+                call = self._calls.get(key)
+        if call is None:
+            call = self._calls[key] = _Call(asyncio.ensure_future(fn(*args, **kwargs)))
+            call.task.add_done_callback(lambda task: self._forget(key, call))
+            self.calls += 1
+        else:
+            self.shared += 1
+        call.waiters += 1
+        try:
+            return await asyncio.shield(call.task)
+        finally:
+            call.waiters -= 1
+            if call.waiters == 0 and not call.task.done():
+                call.task.cancel()
+                self._forget(key, call)
+
+    def _forget(self, key, call):
+        if self._calls.get(key) is call:
+            del self._calls[key]
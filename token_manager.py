@@ -0,0 +1,113 @@
+import threading
+import time
+
+
+# Response codes the ERNIE-ViLG API uses for a missing, invalid or expired access token.
+AUTH_EXPIRED_CODES = (100, 110, 111)
+
+
+class AuthExpiredError(RuntimeError):
+    pass
+
+
+class TokenManager(object):
+    """
+    Caches the access token of an ernie_vilg module and refreshes it before it expires.
+
+    The endpoint does not report an expiry, so tokens are assumed to live for `ttl` seconds.
+    Once a token is within `refresh_margin` seconds of expiring it is refreshed on a
+    background thread while callers keep using the current one. Only one caller refreshes
+    at a time; everybody else waits for that result instead of hitting the endpoint too.
+
+    `module` may also be a function returning the module, for one that is loaded lazily;
+    it is called on the first refresh, which adopts the token the module started with.
+    `apply_token(module)` fetches a new token; by default it calls `module._apply_token`.
+    """
+
+    def __init__(self, module, ttl=24 * 3600, refresh_margin=600, clock=time.monotonic, apply_token=None):
+        self._module = module
+        self.apply_token = apply_token or (lambda module: module._apply_token(module.ak, module.sk))
+        self.ttl = ttl
+        self.refresh_margin = refresh_margin
+        self.clock = clock
+        self.refresh_count = 0
+        self._lock = threading.Lock()
+        self._refresh_lock = threading.Lock()
+        self._background = None
+        self._generation = 0
+        self._token = getattr(module, 'token', None)
+        self._expires_at = clock() + ttl if self._token else 0.0
+
+    @property
+    def module(self):
+        if not hasattr(self._module, '_apply_token'):
+            self._module = self._module()
+        return self._module
+
+    def _snapshot(self):
+        with self._lock:
+            return self._token, self._expires_at, self._generation
+
+    def get(self):
+        return self.current()[0]
+
+    def peek(self):
+        """
+        Return `(token, generation)` if a valid token is cached, else None. Never blocks
+        on the token endpoint, so it is safe to call from an event loop.
+        """
+        token, expires_at, generation = self._snapshot()
+        now = self.clock()
+        if token is None or now >= expires_at:
+            return None
+        if now >= expires_at - self.refresh_margin:
+            self._refresh_in_background()
+        return token, generation
+
+    def current(self):
+        """Return `(token, generation)`, fetching a new token if the cached one expired."""
+        cached = self.peek()
+        if cached is not None:
+            return cached
+        generation = self._snapshot()[2]
+        token = self.refresh(generation)
+        return token, self._snapshot()[2]
+
+    def refresh(self, generation=None):
+        """
+        Fetch a new token unless someone already replaced the one of `generation`
+        (the current one when omitted) while we were waiting for the refresh lock.
+        """
+        if generation is None:
+            generation = self._snapshot()[2]
+        with self._refresh_lock:
+            token, expires_at, current = self._snapshot()
+            if current != generation and token is not None and self.clock() < expires_at:
+                return token
+            module = self.module
+            if token is None and getattr(module, 'token', None):
+                token = module.token
+            else:
+                token = self.apply_token(module)
+            with self._lock:
+                self._token = token
+                self._expires_at = self.clock() + self.ttl
+                self._generation += 1
+                self.refresh_count += 1
+                self.module.token = token
+            return token
+
+    def _refresh_in_background(self):
+        with self._lock:
+            if self._background is not None and self._background.is_alive():
+                return
+            generation = self._generation
+            self._background = threading.Thread(target=self._background_refresh, args=(generation,), daemon=True)
+            self._background.start()
+
+    def _background_refresh(self, generation):
+        try:
+            self.refresh(generation)
+        except Exception:
+            # The current token is still valid; the next get() after it expires retries in the foreground.
+            pass
@@ -0,0 +1,105 @@
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+
+from result_cache import normalize_prompt
+
+
+def _is_ideograph(ch):
+    code = ord(ch)
+    return (0x4E00 <= code <= 0x9FFF or 0x3400 <= code <= 0x4DBF or 0x20000 <= code <= 0x2EBEF
+            or 0xF900 <= code <= 0xFAFF)
+
+
+def _is_kana_or_hangul(ch):
+    code = ord(ch)
+    return (0x3040 <= code <= 0x30FF or 0x31F0 <= code <= 0x31FF or 0xFF66 <= code <= 0xFF9D
+            or 0x1100 <= code <= 0x11FF or 0x3130 <= code <= 0x318F or 0xAC00 <= code <= 0xD7AF)
+
+
+def is_chinese(text):
+    """
+    True when `text` is CJK ideographs plus punctuation, digits and spaces, with no
+    kana, hangul or latin letters, so it can be sent to the generator as-is.
+    """
+    has_ideograph = False
+    for ch in text:
+        if _is_ideograph(ch):
+            has_ideograph = True
+        elif _is_kana_or_hangul(ch) or ch.isalpha():
+            return False
+    return has_ideograph
+
+
+class TranslationCache(object):
+    """
+    Memoizes language recognition and translation to Chinese, keyed by the normalized
+    source text. A bounded in-process LRU sits in front of a SQLite table so translations
+    survive restarts.
+    """
+
+    def __init__(self, path, capacity=4096):
+        self.capacity = capacity
+        self.hits = 0
+        self.misses = 0
+        self.local_detections = 0
+        self._lock = threading.Lock()
+        self._memory = OrderedDict()
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self._db = sqlite3.connect(path, check_same_thread=False)
+        self._db.execute(
+            'CREATE TABLE IF NOT EXISTS translations '
+            '(source TEXT PRIMARY KEY, language TEXT NOT NULL, translation TEXT NOT NULL, created REAL NOT NULL)')
+        self._db.commit()
+
+    def get(self, source):
+        with self._lock:
+            entry = self._memory.get(source)
+            if entry is not None:
+                self._memory.move_to_end(source)
+                return entry
+            row = self._db.execute(
+                'SELECT translation, language FROM translations WHERE source = ?', (source,)).fetchone()
+            if row is None:
+                return None
+            entry = (row[0], row[1])
+            self._remember(source, entry)
+            return entry
+
+    def put(self, source, translation, language_code):
+        with self._lock:
+            self._db.execute(
+                'INSERT OR REPLACE INTO translations (source, language, translation, created) VALUES (?, ?, ?, ?)',
+                (source, language_code, translation, time.time()))
+            self._db.commit()
+            self._remember(source, (translation, language_code))
+
+    def _remember(self, source, entry):
+        self._memory[source] = entry
+        self._memory.move_to_end(source)
+        while len(self._memory) > self.capacity:
+            self._memory.popitem(last=False)
+
+    def translate(self, text, recognize, translate):
+        """
+        Return `(chinese_text, language_code)` for `text`, calling `recognize(text)` and
+        `translate(text, language_code, 'zh')` only on a cache miss.
+        """
+        text = text.strip()
+        source = normalize_prompt(text)
+        if is_chinese(source):
+            with self._lock:
+                self.local_detections += 1
+            return text, 'zh'
+        entry = self.get(source)
+        with self._lock:
+            if entry is not None:
+                self.hits += 1
+                return entry
+            self.misses += 1
+        language_code = recognize(text)
+        translation = text if language_code == 'zh' else translate(text, language_code, 'zh')
+        self.put(source, translation, language_code)
+        return translation, language_code